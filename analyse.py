@@ -1,8 +1,75 @@
+from datetime import datetime
 from typing import Any
 
-from db import get_habits, get_streak_counter, get_habits_periodicity
+from counter import parse_increment_date, parse_timestamp
+from db import COUNTER_COLUMNS, counter_from_row
+from instrument import instrumented
+from periodicity import find_periodicity, get_periodicity, period_index
 import sqlite3
 
+@instrumented("get_streak_table")
+def get_streak_table(db, periodicity=None):
+    """
+    Reads the current streak of every habit in a single query over the tracker table.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        periodicity (str, optional): Only include habits with this periodicity. Defaults to None (all habits).
+
+    Returns:
+        list: A list of (Counter, streak) tuples ordered by habit name.
+    """
+    cur = db.cursor()
+    query = '''SELECT ''' + COUNTER_COLUMNS + ''' FROM tracker'''
+    params = ()
+    if periodicity is not None:
+        query += ''' WHERE periodicity = ?'''
+        params = (periodicity,)
+    query += ''' ORDER BY name'''
+    cur.execute(query, params)
+
+    habits = [counter_from_row(row) for row in cur.fetchall()]
+    return [(habit, habit.current_streak) for habit in habits]
+
+@instrumented("streak_report")
+def streak_report(db):
+    """
+    Builds the full streak analysis from one pass over the streak table.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+
+    Returns:
+        dict: A dictionary with the keys
+              'leaderboard' (list of (Counter, streak) tuples, longest streak first),
+              'longest' (Counter or None), 'shortest' (Counter or None) and
+              'by_periodicity' (dict mapping each periodicity to the Counter with its longest streak).
+    """
+    rows = get_streak_table(db)
+    longest = None
+    shortest = None
+    by_periodicity = {}
+    best_by_periodicity = {}
+
+    for habit, streak in rows:
+        # Ties keep the first habit found, as the original loops did
+        if longest is None or streak > longest[1]:
+            longest = (habit, streak)
+        if shortest is None or streak < shortest[1]:
+            shortest = (habit, streak)
+        # A periodicity winner needs a streak of at least 1
+        if streak > best_by_periodicity.get(habit.periodicity, 0):
+            best_by_periodicity[habit.periodicity] = streak
+            by_periodicity[habit.periodicity] = habit
+
+    return {
+        'leaderboard': sorted(rows, key=lambda row: row[1], reverse=True),
+        'longest': longest[0] if longest else None,
+        'shortest': shortest[0] if shortest else None,
+        'by_periodicity': by_periodicity,
+    }
+
+@instrumented("calculate_longest_streak")
 def calculate_longest_streak(db):
     """
     Calculates the habit with the best (longest) streak.
@@ -13,20 +80,10 @@ def calculate_longest_streak(db):
     Returns:
         Counter: The habit with the best streak, or None if no habits exist.
     """
-    habits = get_habits(db)  # Retrieve all habit names from the database
-    best_streak = None  # Initialize the variable to store the best streak
-
-    # Iterate through each habit to find the best streak
-    for habit_name in habits:
-        habit = get_streak_counter(db, habit_name)  # Retrieve the Counter object for the habit
-        if habit:  # Check if the habit exists
-            streak = habit.count(db)  # Get the current streak count for the habit
-            if best_streak is None or streak > best_streak.count(db):  # Compare the current streak with the best streak found so far
-                best_streak = habit  # Update the best streak if the current streak is longer
-
-    return best_streak  # Return the habit with the best streak
+    return streak_report(db)['longest']
 
 
+@instrumented("calculate_shortest_streak")
 def calculate_shortest_streak(db):
     """
     Calculates the habit with the worst (shortest) streak.
@@ -37,19 +94,9 @@ def calculate_shortest_streak(db):
     Returns:
         Counter: The habit with the worst streak, or None if no habits exist.
     """
-    habits = get_habits(db)  # Retrieve all habit names from the database
-    worst_streak = None  # Initialize the variable to store the worst streak
-
-    # Iterate through each habit to find the worst streak
-    for habit_name in habits:
-        habit = get_streak_counter(db, habit_name)  # Retrieve the Counter object for the habit
-        if habit:  # Check if the habit exists
-            streak = habit.count(db)  # Get the current streak count for the habit
-            if worst_streak is None or streak < worst_streak.count(db):  # Compare the current streak with the worst streak found so far
-                worst_streak = habit  # Update the worst streak if the current streak is shorter
-
-    return worst_streak  # Return the habit with the worst streak
+    return streak_report(db)['shortest']
 
+@instrumented("calculate_all_streaks")
 def calculate_all_streaks(db):
     """
     Calculates the streak for each habit in the database.
@@ -61,17 +108,9 @@ def calculate_all_streaks(db):
         dict: A dictionary where keys are habit names and values are their corresponding streak counts.
              Returns an empty dictionary if there are no habits.
     """
-    habits = get_habits(db)
-    all_streaks = {}
-
-    for habit_name in habits:
-        habit = get_streak_counter(db, habit_name)  # Retrieve the Counter object for the habit
-        if habit:  # Check if the habit exists (not None)
-            streak = habit.count(db)  # Calculate the streak count for the habit
-            all_streaks[habit_name] = streak  # Store the streak count in the dictionary, using habit name as the key
-
-    return all_streaks  # Return the dictionary containing streaks for all habits
+    return {habit.name: streak for habit, streak in get_streak_table(db)}
 
+@instrumented("calculate_longest_streak_by_periodicity")
 def calculate_longest_streak_by_periodicity(db, periodicity):
     """
     Calculates the longest streak for habits with a specific periodicity.
@@ -84,18 +123,235 @@ def calculate_longest_streak_by_periodicity(db, periodicity):
         Counter: The habit with the longest streak for the given periodicity,
                  or None if no habits with that periodicity exist.
     """
-    habits = get_habits_periodicity(db, periodicity)  # Get habit names with the specified periodicity
     longest_streak_habit = None  # Initialize variable to store the habit with the longest streak
     longest_streak_count = 0  # Initialize variable to store the length of the longest streak
 
-    # Iterate through each habit with the specified periodicity
-    for habit_name in habits:
-        habit = get_streak_counter(db, habit_name)  # Get the Counter object for the habit
-        if habit:
-            streak = habit.count(db)  # Calculate the streak count for the habit
-            # Check if the current streak is longer than the longest streak found so far
-            if streak > longest_streak_count:
-                longest_streak_count = streak  # Update the longest streak count
-                longest_streak_habit = habit  # Update the habit with the longest streak
+    for habit, streak in get_streak_table(db, periodicity):
+        # Check if the current streak is longer than the longest streak found so far
+        if streak > longest_streak_count:
+            longest_streak_count = streak  # Update the longest streak count
+            longest_streak_habit = habit  # Update the habit with the longest streak
 
     return longest_streak_habit  # Return the habit with the longest streak, or None if no habits exist
+
+# The window lengths in days reported by calculate_rolling_completion_rates
+ROLLING_WINDOWS = (7, 30, 365)
+
+def _get_rollups(db, first_day, last_day):
+    """
+    Reads the daily completion counts of every habit in a range of days.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        first_day (int): The ordinal of the first day.
+        last_day (int): The ordinal of the last day.
+
+    Returns:
+        dict: A dictionary where keys are habit IDs and values are lists of (day ordinal, completions) tuples.
+    """
+    cur = db.cursor()
+    cur.execute('''SELECT day, habit_id, completions FROM completion_rollup WHERE day BETWEEN ? AND ?''',
+                (first_day, last_day))
+    rollups = {}
+    for day, habit_id, completions in cur.fetchall():
+        rollups.setdefault(habit_id, []).append((day, completions))
+    return rollups
+
+def _first_period(engine, start, creation_date):
+    """
+    Returns the first period a habit can be measured in: the period of start, or of its creation if later.
+    """
+    first = engine.period_index(start)
+    created = parse_timestamp(creation_date)
+    return max(first, engine.period_index(created)) if created else first
+
+@instrumented("calculate_rolling_completion_rates")
+def calculate_rolling_completion_rates(db, windows=ROLLING_WINDOWS, now=None):
+    """
+    Calculates the completion rate of every habit over the last days, for several window lengths.
+
+    The rate is the share of periods touching the window (days, weeks or months, by periodicity) that have
+    at least one completion, not counting periods before the habit was created. Only the daily rollups of
+    the longest window are read, so the cost grows with the window, not with the habit's history.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        windows (tuple, optional): The window lengths in days. Defaults to ROLLING_WINDOWS.
+        now (datetime, optional): The last day of every window. Defaults to now.
+
+    Returns:
+        dict: A dictionary where keys are habit names and values map each window length to a rate between 0 and 1.
+    """
+    if now is None:
+        now = datetime.now()
+    last_day = now.toordinal()
+
+    cur = db.cursor()
+    cur.execute('''SELECT id, name, periodicity, creation_date FROM tracker ORDER BY name''')
+    habits = cur.fetchall()
+
+    # A window starting mid-period counts that whole period, so read back to the start of the earliest one
+    first_day = last_day - max(windows) + 1
+    for engine in {find_periodicity(habit[2]) for habit in habits} - {None}:
+        first_day = min(first_day, engine.period_start(engine.period_index(datetime.fromordinal(first_day))).toordinal())
+    rollups = _get_rollups(db, first_day, last_day)
+
+    rates = {}
+    for habit_id, name, periodicity, creation_date in habits:
+        engine = find_periodicity(periodicity)
+        rates[name] = dict.fromkeys(windows, 0.0)
+        if engine is None:
+            continue
+        last_period = engine.period_index(now)
+        completed = {engine.period_index(datetime.fromordinal(day)) for day, _ in rollups.get(habit_id, ())}
+        for window in windows:
+            first_period = _first_period(engine, datetime.fromordinal(last_day - window + 1), creation_date)
+            if first_period <= last_period:
+                hits = sum(1 for period in completed if first_period <= period <= last_period)
+                rates[name][window] = hits / (last_period - first_period + 1)
+    return rates
+
+@instrumented("get_completions_between")
+def get_completions_between(db, start, end):
+    """
+    Counts the completions of every habit between two dates, from the daily rollups.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        start (str or datetime): The first day, as YYYY-MM-DD or a datetime.
+        end (str or datetime): The last day, included, as YYYY-MM-DD or a datetime.
+
+    Returns:
+        dict: A dictionary where keys are habit names and values are the number of completions in the range.
+    """
+    cur = db.cursor()
+    cur.execute('''SELECT tracker.name, COALESCE(ranged.completions, 0) FROM tracker
+                    LEFT JOIN (SELECT habit_id, SUM(completions) AS completions FROM completion_rollup
+                               WHERE day BETWEEN ? AND ? GROUP BY habit_id) AS ranged
+                    ON ranged.habit_id = tracker.id
+                    ORDER BY tracker.name''',
+                (parse_increment_date(start).toordinal(), parse_increment_date(end).toordinal()))
+    return dict(cur.fetchall())
+
+@instrumented("calculate_slipped_habits")
+def calculate_slipped_habits(db, periodicity='weekly', start=None, now=None):
+    """
+    Finds the habits of a periodicity that missed at least one finished period since a date.
+
+    The current period is not checked, as it can still be completed, and neither are periods before
+    the habit was created.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        periodicity (str, optional): The periodicity to check. Defaults to 'weekly'.
+        start (datetime, optional): The date to check from. Defaults to the first day of the month of now.
+        now (datetime, optional): The current date. Defaults to now.
+
+    Returns:
+        dict: A dictionary where keys are the names of habits that slipped and values are lists with
+              the start of every missed period.
+
+    Raises:
+        ValueError: If the periodicity is unknown.
+    """
+    engine = get_periodicity(periodicity)
+    if now is None:
+        now = datetime.now()
+    if start is None:
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    last_period = engine.period_index(now) - 1  # The last finished period
+    first_day = engine.period_start(engine.period_index(start)).toordinal()
+    rollups = _get_rollups(db, first_day, engine.period_start(last_period + 1).toordinal() - 1)
+
+    cur = db.cursor()
+    cur.execute('''SELECT id, name, creation_date FROM tracker WHERE periodicity = ? ORDER BY name''', (periodicity,))
+    slipped = {}
+    for habit_id, name, creation_date in cur.fetchall():
+        completed = {engine.period_index(datetime.fromordinal(day)) for day, _ in rollups.get(habit_id, ())}
+        missed = [engine.period_start(period) for period in range(_first_period(engine, start, creation_date), last_period + 1)
+                  if period not in completed]
+        if missed:
+            slipped[name] = missed
+    return slipped
+
+@instrumented("calculate_completion_statistics")
+def calculate_completion_statistics(db, now=None):
+    """
+    Calculates streak, completion rate and gap statistics for every habit over its full completion history.
+
+    All completions are loaded into NumPy arrays with one query. Streak runs are then found with
+    vectorized diff/cumsum operations on the stored period indexes, using the same rule as
+    Counter.is_streak_valid: a completion continues a run if it is in the same or the next period.
+    Completions already moved to the streak archive by compaction are not included.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        now (datetime, optional): The end of the period the completion rate is measured over. Defaults to now.
+
+    Returns:
+        dict: A dictionary where keys are habit names and values are dictionaries with the keys
+              'completions', 'longest_streak', 'completion_rate', 'mean_gap_days' and 'max_gap_days'.
+    """
+    import numpy as np  # Only needed for this analysis, so the CLI does not pay for the import
+
+    if now is None:
+        now = datetime.now()
+
+    cur = db.cursor()
+    cur.execute('''SELECT id, name, periodicity FROM tracker ORDER BY id''')
+    habits = cur.fetchall()
+    ids = np.array([habit[0] for habit in habits], dtype=np.int64)
+    now_periods = np.array([period_index(habit[2], now) for habit in habits], dtype=np.float64)  # NaN if unknown
+
+    cur.execute('''SELECT habit_id, period_index, julianday(increment_date) FROM counter
+                   ORDER BY habit_id, increment_date''')
+    log = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 3)
+    habit_index = np.searchsorted(ids, log[:, 0].astype(np.int64))  # Position of each completion's habit
+    periods = log[:, 1]
+    days = log[:, 2]
+
+    completions = np.bincount(habit_index, minlength=len(ids))
+    longest = np.zeros(len(ids), dtype=np.int64)
+    rate = np.zeros(len(ids), dtype=np.float64)
+    mean_gap = np.zeros(len(ids), dtype=np.float64)
+    max_gap = np.zeros(len(ids), dtype=np.float64)
+
+    if len(days):
+        same_habit = habit_index[1:] == habit_index[:-1]
+
+        # A run starts at each habit's first completion and wherever a period is skipped
+        run_starts = np.ones(len(days), dtype=bool)
+        run_starts[1:] = ~same_habit | ~(np.diff(periods) <= 1)
+        run_id = np.cumsum(run_starts) - 1
+        run_lengths = np.bincount(run_id)
+        np.maximum.at(longest, habit_index[run_starts], run_lengths)
+
+        # Gaps in days between consecutive completions of the same habit
+        gaps = np.diff(days)[same_habit]
+        gap_habits = habit_index[1:][same_habit]
+        gap_counts = np.bincount(gap_habits, minlength=len(ids))
+        gap_sums = np.bincount(gap_habits, weights=gaps, minlength=len(ids))
+        np.divide(gap_sums, gap_counts, out=mean_gap, where=gap_counts > 0)
+        np.maximum.at(max_gap, gap_habits, gaps)
+
+        # Completion rate: the share of periods since the first completion that have at least one completion
+        known = np.isfinite(periods)
+        completed = np.unique(np.stack([habit_index[known], periods[known].astype(np.int64)]), axis=1)
+        completed_periods = np.bincount(completed[0], minlength=len(ids))
+        first_period = np.full(len(ids), np.inf)
+        np.minimum.at(first_period, habit_index[known], periods[known])
+        has_periods = np.isfinite(first_period) & np.isfinite(now_periods)
+        expected = np.maximum(now_periods[has_periods] - first_period[has_periods] + 1, 1)
+        rate[has_periods] = np.minimum(completed_periods[has_periods] / expected, 1.0)
+
+    return {
+        habit[1]: {
+            'completions': int(completions[i]),
+            'longest_streak': int(longest[i]),
+            'completion_rate': float(rate[i]),
+            'mean_gap_days': float(mean_gap[i]),
+            'max_gap_days': float(max_gap[i]),
+        }
+        for i, habit in enumerate(habits)
+    }
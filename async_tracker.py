@@ -0,0 +1,171 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import analyse
+from db import get_counter_by_id, get_counters, get_habits, get_habits_periodicity, get_streak_counter
+from pool import ConnectionPool
+from scheduler import due_before
+
+class AsyncTracker:
+    """
+    An asyncio front-end to the tracker that never blocks the event loop on SQLite.
+
+    Single-habit lookups and analyses run on separate executors, so a quick lookup is never queued
+    behind a long analysis scan. Writes go through the connection pool's write queue. Every lane
+    accepts a bounded number of pending calls; further callers wait until a slot is free.
+    """
+
+    def __init__(self, name='main.db', profile='balanced', lookup_workers=4, analysis_workers=1, max_pending=64):
+        """
+        Initializes an AsyncTracker.
+
+        Args:
+            name (str, optional): The name of the database file. Defaults to 'main.db'.
+            profile (str, optional): The performance profile of every connection. Defaults to 'balanced'.
+            lookup_workers (int, optional): The number of threads serving lookups. Defaults to 4.
+            analysis_workers (int, optional): The number of threads serving analyses. Defaults to 1.
+            max_pending (int, optional): The maximum number of pending calls per lane. Defaults to 64.
+        """
+        self.pool = ConnectionPool(name, profile)
+        self._lookups = ThreadPoolExecutor(lookup_workers, thread_name_prefix='tracker-lookup')
+        self._analyses = ThreadPoolExecutor(analysis_workers, thread_name_prefix='tracker-analysis')
+        self._lookup_slots = asyncio.Semaphore(max_pending)
+        self._analysis_slots = asyncio.Semaphore(max_pending)
+        self._write_slots = asyncio.Semaphore(max_pending)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _read(self, executor, slots, func, *args):
+        """
+        Runs a read function on an executor thread with that thread's pooled connection.
+
+        Args:
+            executor (ThreadPoolExecutor): The lane's executor.
+            slots (asyncio.Semaphore): The lane's pending-call limit.
+            func (callable): The function, called as func(db, *args).
+            *args: The arguments to pass after the connection.
+
+        Returns:
+            The function's return value.
+        """
+        async with slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, lambda: func(self.pool.connection(), *args))
+
+    async def _write(self, submit, *args):
+        """
+        Queues a write on the pool's write queue and waits for its batch to commit.
+
+        Args:
+            submit (callable): The WriteQueue method to call.
+            *args: The arguments to pass to it.
+
+        Returns:
+            The write's result.
+        """
+        async with self._write_slots:
+            return await asyncio.wrap_future(submit(*args))
+
+    async def get_habits(self):
+        """
+        Retrieves a list of all habit names, see db.get_habits.
+        """
+        return await self._read(self._lookups, self._lookup_slots, get_habits)
+
+    async def get_habits_periodicity(self, periodicity):
+        """
+        Retrieves a list of habit names with a specific periodicity, see db.get_habits_periodicity.
+        """
+        return await self._read(self._lookups, self._lookup_slots, get_habits_periodicity, periodicity)
+
+    async def get_streak_counter(self, name):
+        """
+        Retrieves a habit's Counter by name, see db.get_streak_counter.
+        """
+        return await self._read(self._lookups, self._lookup_slots, get_streak_counter, name)
+
+    async def get_counter_by_id(self, habit_id):
+        """
+        Retrieves a habit's Counter by ID, see db.get_counter_by_id.
+        """
+        return await self._read(self._lookups, self._lookup_slots, get_counter_by_id, habit_id)
+
+    async def get_counters(self, ids):
+        """
+        Retrieves the Counters of many habits by ID, see db.get_counters.
+        """
+        return await self._read(self._lookups, self._lookup_slots, get_counters, list(ids))
+
+    async def due_before(self, timestamp, since=None, limit=None):
+        """
+        Finds the habits whose streak breaks before a moment, see scheduler.due_before.
+        """
+        return await self._read(self._lookups, self._lookup_slots, due_before, timestamp, since, limit)
+
+    async def store(self, counter):
+        """
+        Stores a new habit, see Counter.store.
+        """
+        return await self._write(self.pool.writes.store, counter)
+
+    async def increment(self, name, increment_date=None):
+        """
+        Completes a habit by name, see Counter.increment.
+        """
+        return await self._write(self.pool.writes.increment, name, increment_date)
+
+    async def remove(self, name):
+        """
+        Removes a habit by name, see Counter.remove.
+        """
+        return await self._write(self.pool.writes.remove, name)
+
+    async def calculate_longest_streak(self):
+        """
+        Calculates the habit with the longest streak, see analyse.calculate_longest_streak.
+        """
+        return await self._read(self._analyses, self._analysis_slots, analyse.calculate_longest_streak)
+
+    async def calculate_shortest_streak(self):
+        """
+        Calculates the habit with the shortest streak, see analyse.calculate_shortest_streak.
+        """
+        return await self._read(self._analyses, self._analysis_slots, analyse.calculate_shortest_streak)
+
+    async def calculate_all_streaks(self):
+        """
+        Calculates the streak of every habit, see analyse.calculate_all_streaks.
+        """
+        return await self._read(self._analyses, self._analysis_slots, analyse.calculate_all_streaks)
+
+    async def calculate_longest_streak_by_periodicity(self, periodicity):
+        """
+        Calculates the longest streak for a periodicity, see analyse.calculate_longest_streak_by_periodicity.
+        """
+        return await self._read(self._analyses, self._analysis_slots,
+                                analyse.calculate_longest_streak_by_periodicity, periodicity)
+
+    async def streak_report(self):
+        """
+        Builds the full streak report, see analyse.streak_report.
+        """
+        return await self._read(self._analyses, self._analysis_slots, analyse.streak_report)
+
+    async def calculate_completion_statistics(self, now=None):
+        """
+        Calculates full-history statistics, see analyse.calculate_completion_statistics.
+        """
+        return await self._read(self._analyses, self._analysis_slots, analyse.calculate_completion_statistics, now)
+
+    async def close(self):
+        """
+        Waits for running calls to finish, then closes the executors and the connection pool.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._lookups.shutdown)
+        await loop.run_in_executor(None, self._analyses.shutdown)
+        await loop.run_in_executor(None, self.pool.close)
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from analyse import calculate_longest_streak, calculate_shortest_streak, calculate_all_streaks, calculate_longest_streak_by_periodicity, calculate_completion_statistics
+from db import apply_profile, get_db, get_habits, get_streak_counter, migrate, SCHEMA_VERSION
+from example_data import generate_data
+
+# The (habits, days of history) data sizes the public operations are timed at
+SIZES = [(10, 30), (100, 365), (1000, 365)]
+# The number of habits each per-habit operation is timed on
+SAMPLES = 10
+# A metric is a regression if it is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and slower by more than this many milliseconds, so timer noise on tiny metrics is ignored
+NOISE_FLOOR_MS = 0.05
+
+def fill_completions(db, rows, habits=100):
+    """
+    Fills the tracker with habits and the counter table with synthetic completions.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        rows (int): The total number of completion rows to insert.
+        habits (int, optional): The number of habits to spread the rows over. Defaults to 100.
+    """
+    cur = db.cursor()
+    cur.executemany('''INSERT INTO tracker (id, name, description, periodicity) VALUES (?, ?, ?, ?)''',
+                    ((i, f"habit_{i}", "benchmark habit", "daily") for i in range(1, habits + 1)))
+    start = datetime(2000, 1, 1)
+    cur.executemany('''INSERT INTO counter (habit_id, increment_date) VALUES (?, ?)''',
+                    ((i % habits + 1, str(start + timedelta(days=i // habits))) for i in range(rows)))
+    db.commit()
+
+def time_call(func, *args):
+    """
+    Times a single call.
+
+    Args:
+        func (callable): The function to call.
+        *args: The arguments to call it with.
+
+    Returns:
+        float: The elapsed time in milliseconds.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+def count_completions(db, habit_id):
+    """
+    Counts a habit's completions in the log, as Counter.count did before the streak was materialized.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_id (int): The ID of the habit.
+
+    Returns:
+        int: The number of logged completions.
+    """
+    return db.execute('''SELECT COUNT(*) FROM counter WHERE habit_id = ?''', (habit_id,)).fetchone()[0]
+
+def delete_completions(db, habit_id):
+    """
+    Deletes a habit's completions from the log, as Counter.reset did before the streak was materialized.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_id (int): The ID of the habit.
+    """
+    db.execute('''DELETE FROM counter WHERE habit_id = ?''', (habit_id,))
+    db.commit()
+
+def measure_count_reset(db, habit_ids):
+    """
+    Measures the average latency of counting and deleting one habit's completion log.
+
+    Deleting removes the habit's completions, so every measurement uses its own habit.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_ids (list): The ids of the habits to measure, one count and one reset each.
+
+    Returns:
+        dict: The average 'count_ms' and 'reset_ms' latencies.
+    """
+    count_ms = [time_call(count_completions, db, habit_id) for habit_id in habit_ids]
+    reset_ms = [time_call(delete_completions, db, habit_id) for habit_id in habit_ids]
+    return {'count_ms': sum(count_ms) / len(count_ms), 'reset_ms': sum(reset_ms) / len(reset_ms)}
+
+def benchmark_indexes(rows=1_000_000, habits=100, samples=5):
+    """
+    Compares count/reset latency on the unindexed version 1 schema with the fully migrated schema.
+
+    Args:
+        rows (int, optional): The number of completion rows. Defaults to 1,000,000.
+        habits (int, optional): The number of habits. Defaults to 100.
+        samples (int, optional): The number of habits measured per schema. Defaults to 5.
+
+    Returns:
+        dict: The 'before' and 'after' measurements.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = sqlite3.connect(os.path.join(tmp, 'benchmark.db'))
+        migrate(db, target=1)
+        fill_completions(db, rows, habits)
+
+        before = measure_count_reset(db, range(1, samples + 1))
+        migrate(db)
+        db.execute("PRAGMA foreign_keys = ON")
+        after = measure_count_reset(db, range(samples + 1, 2 * samples + 1))
+        db.close()
+
+    return {'before': before, 'after': after}
+
+def best_time(func, *args, repeat=5):
+    """
+    Times a call several times and keeps the fastest run.
+
+    Args:
+        func (callable): The function to call.
+        *args: The arguments to call it with.
+        repeat (int, optional): The number of runs. Defaults to 5.
+
+    Returns:
+        float: The fastest elapsed time in milliseconds.
+    """
+    return min(time_call(func, *args) for _ in range(repeat))
+
+def benchmark_operations(habits, days, seed=0):
+    """
+    Times the tracker's public operations on a fresh database of generated data.
+
+    Args:
+        habits (int): The number of habits to generate.
+        days (int): The number of days of history to generate.
+        seed (int, optional): The seed for the data generator. Defaults to 0.
+
+    Returns:
+        dict: The time in milliseconds of each operation, keyed by operation name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, 'benchmark.db'), profile='bulk')
+        names = generate_data(db, habits, days, end_date=datetime(2025, 1, 1), seed=seed)
+        apply_profile(db, 'durable')  # Time the operations with the settings the CLI uses
+        counters = [get_streak_counter(db, name) for name in names[:SAMPLES]]
+
+        # Per-habit operations use the median over several habits, which is less sensitive to fsync outliers
+        results['Counter.count'] = statistics.median(time_call(counter.count, db) for counter in counters)
+        results['Counter.increment'] = statistics.median(time_call(counter.increment, db, "2025-01-02") for counter in counters)
+        results['db.get_streak_counter'] = statistics.median(time_call(get_streak_counter, db, name) for name in names[:SAMPLES])
+
+        results['db.get_habits'] = best_time(get_habits, db)
+        for func in (calculate_longest_streak, calculate_shortest_streak, calculate_all_streaks):
+            results[f'analyse.{func.__name__}'] = best_time(func, db)
+        results['analyse.calculate_longest_streak_by_periodicity'] = best_time(calculate_longest_streak_by_periodicity, db, "daily")
+        try:
+            results['analyse.calculate_completion_statistics'] = best_time(calculate_completion_statistics, db)
+        except ImportError:
+            pass  # numpy is not installed
+        db.close()
+
+    return results
+
+def run_benchmarks(sizes=SIZES):
+    """
+    Times every operation at every data size.
+
+    Args:
+        sizes (list, optional): The (habits, days) sizes to run. Defaults to SIZES.
+
+    Returns:
+        dict: The time in milliseconds of each metric, keyed as 'operation[habits x days]'.
+    """
+    results = {}
+    for habits, days in sizes:
+        for operation, elapsed in benchmark_operations(habits, days).items():
+            results[f'{operation}[{habits}x{days}]'] = elapsed
+    return results
+
+def find_regressions(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares benchmark results with a stored baseline.
+
+    Args:
+        baseline (dict): The baseline times in milliseconds, keyed by metric.
+        results (dict): The new times in milliseconds, keyed by metric.
+        tolerance (float, optional): The allowed relative slowdown. Defaults to DEFAULT_TOLERANCE.
+
+    Returns:
+        list: (metric, baseline ms, result ms) tuples for every tracked metric that got meaningfully slower.
+    """
+    regressions = []
+    for metric, expected in sorted(baseline.items()):
+        actual = results.get(metric)
+        if actual is None:
+            continue  # The metric is not tracked by this run
+        if actual > expected * (1 + tolerance) and actual - expected > NOISE_FLOOR_MS:
+            regressions.append((metric, expected, actual))
+    return regressions
+
+def main(argv=None):
+    """
+    Runs the benchmark command line.
+
+    Args:
+        argv (list, optional): The command line arguments. Defaults to None (sys.argv).
+
+    Returns:
+        int: The exit code; 1 if the regression check failed.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks for the habit tracker.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="time every operation and write the results as JSON")
+    run.add_argument('--output', default='benchmark_results.json')
+
+    check = commands.add_parser('check', help="time every operation and compare with a baseline")
+    check.add_argument('--baseline', default='benchmark_baseline.json')
+    check.add_argument('--output', default='benchmark_results.json')
+    check.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+
+    indexes = commands.add_parser('indexes', help="compare count/reset latency before and after the migrations")
+    indexes.add_argument('rows', type=int, nargs='?', default=1_000_000)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'indexes':
+        results = benchmark_indexes(args.rows)
+        print(f"count/reset latency with {args.rows} completion rows")
+        for label, version in (('before', 1), ('after', SCHEMA_VERSION)):
+            result = results[label]
+            print(f"  schema v{version}: count {result['count_ms']:.3f} ms, reset {result['reset_ms']:.3f} ms")
+        return 0
+
+    results = run_benchmarks()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    for metric, elapsed in sorted(results.items()):
+        print(f"{metric}: {elapsed:.3f} ms")
+
+    if args.command == 'check':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(baseline, results, args.tolerance)
+        for metric, expected, actual in regressions:
+            print(f"REGRESSION {metric}: {expected:.3f} ms -> {actual:.3f} ms")
+        if regressions:
+            return 1
+        print("No regressions.")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+from collections import OrderedDict
+
+class CounterCache:
+    """
+    An opt-in, size-bounded LRU identity map of Counter objects, keyed by connection and habit id or name.
+
+    Connections from db.get_db drop their entries when they are closed.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Initializes a disabled CounterCache.
+
+        Args:
+            maxsize (int, optional): The maximum number of habits kept in the cache. Defaults to 1024.
+        """
+        self.maxsize = maxsize
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._by_id = OrderedDict()  # (db, habit id) -> Counter, least recently used first
+        self._ids_by_name = {}  # (db, habit name) -> habit id
+
+    def enable(self, maxsize=None):
+        """
+        Turns the cache on.
+
+        Args:
+            maxsize (int, optional): A new maximum size. Defaults to None (keep the current size).
+        """
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.enabled = True
+        self._evict()
+
+    def disable(self):
+        """
+        Turns the cache off and empties it.
+        """
+        self.enabled = False
+        self.clear()
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit and miss counters.
+        """
+        self._by_id.clear()
+        self._ids_by_name.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def forget(self, db):
+        """
+        Drops every habit cached for a connection, e.g. when it is closed.
+
+        Args:
+            db (sqlite3.Connection): The database connection.
+        """
+        for key in [key for key in self._by_id if key[0] is db]:
+            del self._by_id[key]
+        for key in [key for key in self._ids_by_name if key[0] is db]:
+            del self._ids_by_name[key]
+
+    def get(self, db, name=None, habit_id=None):
+        """
+        Looks up a cached Counter by habit id or name.
+
+        Args:
+            db (sqlite3.Connection): The database connection the habit was loaded from.
+            name (str, optional): The name of the habit.
+            habit_id (int, optional): The ID of the habit.
+
+        Returns:
+            Counter: The cached Counter, or None on a miss or if the cache is disabled.
+        """
+        if not self.enabled:
+            return None
+
+        if habit_id is None:
+            habit_id = self._ids_by_name.get((db, name))
+        counter = self._by_id.get((db, habit_id))
+
+        if counter is None:
+            self.misses += 1
+            return None
+
+        self._by_id.move_to_end((db, habit_id))
+        self.hits += 1
+        return counter
+
+    def put(self, db, counter):
+        """
+        Adds a stored Counter to the cache, evicting the least recently used habits if it is full.
+
+        Args:
+            db (sqlite3.Connection): The database connection the habit was loaded from.
+            counter (Counter): The habit to cache.
+        """
+        if not self.enabled or counter.id is None:
+            return
+
+        self._by_id[(db, counter.id)] = counter
+        self._by_id.move_to_end((db, counter.id))
+        self._ids_by_name[(db, counter.name)] = counter.id
+        self._evict()
+
+    def invalidate(self, db, counter):
+        """
+        Drops a habit from the cache after it has been written, so the next lookup reloads it.
+
+        Args:
+            db (sqlite3.Connection): The database connection the habit was written through.
+            counter (Counter): The habit that changed.
+        """
+        if not self.enabled:
+            return
+
+        habit_id = self._ids_by_name.pop((db, counter.name), counter.id)
+        cached = self._by_id.pop((db, habit_id), None)
+        if cached is not None and cached.name != counter.name:
+            self._ids_by_name.pop((db, cached.name), None)
+
+    def stats(self):
+        """
+        Reports how well the cache is doing.
+
+        Returns:
+            dict: The number of hits and misses, the hit rate and the current and maximum size.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._by_id),
+            'maxsize': self.maxsize,
+        }
+
+    def _evict(self):
+        """
+        Removes the least recently used habits until the cache fits in maxsize.
+        """
+        while len(self._by_id) > self.maxsize:
+            (db, habit_id), counter = self._by_id.popitem(last=False)
+            if self._ids_by_name.get((db, counter.name)) == habit_id:
+                del self._ids_by_name[(db, counter.name)]
+
+class HabitIndex:
+    """
+    An opt-in, in-memory map between habit names and ids, loaded once per connection.
+
+    Counter.store, Counter.remove and db.add_habit keep it in sync. Like the counter cache, it only sees
+    habits written through the same connection, so enable it where one connection owns the habits.
+    Connections from db.get_db drop their map when they are closed.
+    """
+
+    def __init__(self):
+        """
+        Initializes a disabled HabitIndex.
+        """
+        self.enabled = False
+        self._ids = {}  # db -> {habit name: habit id}
+        self._names = {}  # db -> {habit id: habit name}
+
+    def enable(self):
+        """
+        Turns the index on; each connection's map is loaded on its first lookup.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Turns the index off and empties it.
+        """
+        self.enabled = False
+        self.clear()
+
+    def clear(self):
+        """
+        Empties the index, so every map is loaded again on its next lookup.
+        """
+        self._ids.clear()
+        self._names.clear()
+
+    def forget(self, db):
+        """
+        Drops the map of a connection, e.g. when it is closed.
+
+        Args:
+            db (sqlite3.Connection): The database connection.
+        """
+        self._ids.pop(db, None)
+        self._names.pop(db, None)
+
+    def resolve(self, db, names):
+        """
+        Looks up the ids of habit names.
+
+        Args:
+            db (sqlite3.Connection): The database connection object.
+            names (iterable): The habit names.
+
+        Returns:
+            dict: A dictionary mapping each known name to its habit id, or None if the index is disabled.
+        """
+        if not self.enabled:
+            return None
+        ids = self._load(db)
+        return {name: ids[name] for name in names if name in ids}
+
+    def name_of(self, db, habit_id):
+        """
+        Looks up the name of a habit id.
+
+        Args:
+            db (sqlite3.Connection): The database connection object.
+            habit_id (int): The ID of the habit.
+
+        Returns:
+            str: The habit name, or None if it is unknown or the index is disabled.
+        """
+        if not self.enabled:
+            return None
+        self._load(db)
+        return self._names[db].get(habit_id)
+
+    def add(self, db, habit_id, name):
+        """
+        Records a stored habit in a loaded map.
+
+        Args:
+            db (sqlite3.Connection): The database connection the habit was stored through.
+            habit_id (int): The ID of the habit.
+            name (str): The name of the habit.
+        """
+        if self.enabled and db in self._ids and habit_id is not None:
+            self._ids[db][name] = habit_id
+            self._names[db][habit_id] = name
+
+    def discard(self, db, name):
+        """
+        Forgets a removed habit.
+
+        Args:
+            db (sqlite3.Connection): The database connection the habit was removed through.
+            name (str): The name of the habit.
+        """
+        if db in self._ids:
+            habit_id = self._ids[db].pop(name, None)
+            self._names[db].pop(habit_id, None)
+
+    def _load(self, db):
+        """
+        Returns a connection's name -> id map, reading every habit the first time.
+        """
+        ids = self._ids.get(db)
+        if ids is None:
+            rows = db.execute('''SELECT id, name FROM tracker''').fetchall()
+            ids = self._ids[db] = {name: habit_id for habit_id, name in rows}
+            self._names[db] = {habit_id: name for habit_id, name in rows}
+        return ids
+
+# The cache shared by db.get_streak_counter and the Counter write methods; call counter_cache.enable() to use it
+counter_cache = CounterCache()
+# The name <-> id map used by db.get_habit_ids; call habit_index.enable() to use it
+habit_index = HabitIndex()
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from db import get_db
+from history import build_checkpoints
+
+def compact(db, time_budget=1.0, batch_size=100, keep_epochs=1, vacuum_pages=256):
+    """
+    Moves finished streak epochs from the completion log into the streak_archive summary table.
+
+    Habits are compacted in small transactions, so write locks are only held briefly, and the job stops
+    once the time budget is spent; the next run continues where this one stopped. Any time left is
+    used to return freed pages to the file system with incremental_vacuum. Databases created before
+    the log became append-only have no incremental vacuum; their freed pages are reused by new completions.
+
+    The streak checkpoints of the compacted habits are brought up to date first. Streaks as of a past date
+    (see history.py) are replayed from the daily rollups, which compaction keeps, so they stay exact to the day.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        time_budget (float, optional): The number of seconds the job may run. Defaults to 1.0.
+        batch_size (int, optional): The number of habits compacted per transaction. Defaults to 100.
+        keep_epochs (int, optional): The number of most recent epochs kept in the log, at least the current
+            one. Defaults to 1.
+        vacuum_pages (int, optional): The number of pages freed per incremental_vacuum step. Defaults to 256.
+
+    Returns:
+        dict: The number of 'archived_epochs', 'deleted_completions' and 'freed_pages', the 'seconds'
+              taken, and whether the job 'finished' all pending work within the budget.
+    """
+    start = time.monotonic()
+    deadline = start + time_budget
+    keep_epochs = max(keep_epochs, 1)
+    result = {'archived_epochs': 0, 'deleted_completions': 0, 'freed_pages': 0, 'finished': False}
+
+    cur = db.cursor()
+    while time.monotonic() < deadline:
+        # Habits with at least one finished epoch older than the kept ones that is not yet archived
+        cur.execute('''SELECT id, streak_epoch - ? FROM tracker WHERE streak_epoch - ? > compacted_epoch LIMIT ?''',
+                    (keep_epochs - 1, keep_epochs, batch_size))
+        habits = cur.fetchall()
+        if not habits:
+            result['finished'] = True
+            break
+
+        # The checkpoints keep past streaks cheap to replay once the raw completions are gone
+        build_checkpoints(db, [habit_id for habit_id, below_epoch in habits])
+        for habit_id, below_epoch in habits:
+            # Summarize every epoch below the ones kept, then drop their raw completions
+            cur.execute('''INSERT OR REPLACE INTO streak_archive
+                            (habit_id, epoch, first_completed, last_completed, first_period, last_period, completions)
+                            SELECT habit_id, epoch, MIN(increment_date), MAX(increment_date),
+                                   MIN(period_index), MAX(period_index), COUNT(*)
+                            FROM counter WHERE habit_id = ? AND epoch < ? GROUP BY epoch''', (habit_id, below_epoch))
+            result['archived_epochs'] += cur.rowcount
+            cur.execute('''DELETE FROM counter WHERE habit_id = ? AND epoch < ?''', (habit_id, below_epoch))
+            result['deleted_completions'] += cur.rowcount
+            cur.execute('''UPDATE tracker SET compacted_epoch = ? WHERE id = ?''', (below_epoch - 1, habit_id))
+        db.commit()
+
+    # Hand the freed pages back, a few at a time so the budget is respected
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        while time.monotonic() < deadline:
+            free_pages = db.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages:
+                break
+            db.execute(f"PRAGMA incremental_vacuum({vacuum_pages})").fetchall()
+            result['freed_pages'] += free_pages - db.execute("PRAGMA freelist_count").fetchone()[0]
+
+    result['seconds'] = time.monotonic() - start
+    return result
+
+class CompactionJob:
+    """
+    Runs compact() in a background thread at a fixed interval, on its own connection.
+    """
+
+    def __init__(self, name='main.db', interval=3600, time_budget=1.0, keep_epochs=1):
+        """
+        Initializes a CompactionJob.
+
+        Args:
+            name (str, optional): The name of the database file. Defaults to 'main.db'.
+            interval (float, optional): The number of seconds between runs. Defaults to 3600.
+            time_budget (float, optional): The number of seconds each run may take. Defaults to 1.0.
+            keep_epochs (int, optional): The number of most recent epochs kept in the log. Defaults to 1.
+        """
+        self.name = name
+        self.interval = interval
+        self.time_budget = time_budget
+        self.keep_epochs = keep_epochs
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"CompactionJob({name})", daemon=True)
+
+    def start(self):
+        """
+        Starts the background thread.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread after the current run.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        """
+        The background thread: compacts, then sleeps until the next run or until stopped.
+        """
+        db = get_db(self.name, profile='balanced')
+        if db is None:
+            return
+        try:
+            while not self._stop.is_set():
+                self.last_result = compact(db, self.time_budget, keep_epochs=self.keep_epochs)
+                self._stop.wait(self.interval)
+        finally:
+            db.close()
@@ -1,12 +1,102 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import sqlite3
 
+from cache import counter_cache, habit_index
+from events import logger
+from instrument import instrumented
+from periodicity import find_periodicity, next_due
+
+# Writes the materialized streak state and the streak deadline of one habit
+UPDATE_STREAK = '''UPDATE tracker SET last_completed = ?, current_streak = ?, longest_streak = ?, streak_start = ?,
+                     streak_epoch = ?, next_due = ? WHERE id = ?'''
+
+# Appends one completion to the log, tagged with its period and streak epoch
+INSERT_COMPLETION = '''INSERT INTO counter (habit_id, increment_date, period_index, epoch) VALUES (?, ?, ?, ?)'''
+
+# Drops the history checkpoints a completion on an earlier day makes outdated
+INVALIDATE_CHECKPOINTS = '''DELETE FROM streak_checkpoint WHERE habit_id = ? AND day > ?'''
+
+# Adds completions to the daily rollup of one habit
+UPSERT_ROLLUP = '''INSERT INTO completion_rollup (day, habit_id, completions) VALUES (?, ?, ?)
+                   ON CONFLICT (day, habit_id) DO UPDATE SET completions = completions + excluded.completions'''
+
+def parse_increment_date(increment_date):
+    """
+    Converts a completion date given as a YYYY-MM-DD string to a datetime.
+
+    Args:
+        increment_date (str or datetime): The completion date.
+
+    Returns:
+        datetime: The completion date.
+    """
+    if isinstance(increment_date, datetime):
+        return increment_date
+    return datetime.strptime(increment_date, "%Y-%m-%d")
+
+def parse_timestamp(value):
+    """
+    Converts a date stored in the database to a datetime.
+
+    Args:
+        value (str or datetime): The stored date, e.g. '2025-01-30 00:00:00', or None.
+
+    Returns:
+        datetime: The parsed date, or None if no date is stored.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+@instrumented("import_completions")
+def import_completions(db, completions):
+    """
+    Records completions for many habits in a single transaction.
+
+    The completions are consumed as they are written, so a generator can stream them in chunks.
+    A habit may appear in several chunks; each chunk continues its streak from the previous one.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        completions (iterable): Pairs of a stored Counter and the completion dates to record for it.
+
+    Returns:
+        int: The total number of completions recorded, or 0 if the import failed.
+    """
+    cur = db.cursor()
+    originals = {}  # The streak state of every counter before the import, restored if it fails
+    total = 0
+    try:
+        for counter, dates in completions:
+            originals.setdefault(counter.id, (counter, counter._get_streak()))
+            recorded, streak = counter._write_increments(cur, dates)
+            counter._set_streak(streak)
+            total += recorded
+        db.commit()
+    except (sqlite3.Error, ValueError) as e:
+        db.rollback()
+        for counter, streak in originals.values():
+            counter._set_streak(streak)
+        logger.error("An error occurred while importing completions: %s", e)
+        return 0
+
+    for counter, streak in originals.values():
+        counter_cache.invalidate(db, counter)
+    logger.info("Imported %d completions for %d habits.", total, len(originals))
+    return total
+
 class Counter:
     """
     Represents a habit counter with methods for tracking and managing habit streaks.
+
+    Dates loaded from the database are kept as strings and parsed into datetimes on first access.
     """
 
-    def __init__(self, name, description, periodicity, habit_id=None, last_completed=None):
+    __slots__ = ('id', 'name', 'description', 'periodicity', 'current_streak', 'longest_streak', 'streak_epoch',
+                 '_creation_date', '_last_completed', '_streak_start')
+
+    def __init__(self, name, description, periodicity, habit_id=None, last_completed=None,
+                 current_streak=0, longest_streak=0, streak_start=None, creation_date=None, streak_epoch=0):
         """
         Initializes a Counter object.
 
@@ -16,14 +106,62 @@ class Counter:
             periodicity (str): The frequency of the habit (e.g., "daily", "weekly", "monthly").
             habit_id (int, optional): The ID of the habit in the database. Defaults to None.
             last_completed (datetime, optional): The last date the habit was completed. Defaults to None.
+            current_streak (int, optional): The length of the current streak. Defaults to 0.
+            longest_streak (int, optional): The length of the longest streak ever reached. Defaults to 0.
+            streak_start (datetime, optional): The first completion of the current streak. Defaults to None.
+            creation_date (datetime, optional): The date the habit was created. Defaults to None
+                (now for a new habit, unknown for a habit loaded from the database).
+            streak_epoch (int, optional): The number of streaks started so far; completions of the current
+                streak are logged with this epoch. Defaults to 0.
         """
+        if creation_date is None and habit_id is None:
+            creation_date = datetime.now()
+
         self.id = habit_id
         self.name = name
         self.description = description
         self.periodicity = periodicity
-        self.creation_date = datetime.now()
+        self.creation_date = creation_date
         self.last_completed = last_completed
+        self.current_streak = current_streak
+        self.longest_streak = longest_streak
+        self.streak_start = streak_start
+        self.streak_epoch = streak_epoch
+
+    @property
+    def creation_date(self):
+        """datetime: The date the habit was created, or None if unknown."""
+        if isinstance(self._creation_date, str):
+            self._creation_date = parse_timestamp(self._creation_date)
+        return self._creation_date
+
+    @creation_date.setter
+    def creation_date(self, value):
+        self._creation_date = value
+
+    @property
+    def last_completed(self):
+        """datetime: The last date the habit was completed, or None."""
+        if isinstance(self._last_completed, str):
+            self._last_completed = parse_timestamp(self._last_completed)
+        return self._last_completed
+
+    @last_completed.setter
+    def last_completed(self, value):
+        self._last_completed = value
+
+    @property
+    def streak_start(self):
+        """datetime: The first completion of the current streak, or None."""
+        if isinstance(self._streak_start, str):
+            self._streak_start = parse_timestamp(self._streak_start)
+        return self._streak_start
 
+    @streak_start.setter
+    def streak_start(self, value):
+        self._streak_start = value
+
+    @instrumented("Counter.store")
     def store(self, db):
         """
         Stores the habit in the database.
@@ -44,12 +182,15 @@ class Counter:
                         (self.name, self.description, self.periodicity, self.creation_date, self.last_completed))
             db.commit()
             self.id = cur.lastrowid
-            print(f"Stored habit with ID: {self.id}")
+            counter_cache.invalidate(db, self)
+            habit_index.add(db, self.id, self.name)
+            logger.info("Stored habit with ID: %s", self.id)
         except sqlite3.IntegrityError:
-            print(f"Counter '{self.name}' already exists.")
+            logger.warning("Counter '%s' already exists.", self.name)
         except sqlite3.Error as e:
-            print(f"An error occurred while storing the counter: {e}")
+            logger.error("An error occurred while storing the counter: %s", e)
 
+    @instrumented("Counter.increment")
     def increment(self, db, increment_date=None):
         """
         Increments the habit counter in the database.
@@ -61,76 +202,215 @@ class Counter:
         if increment_date is None:
             increment_date = datetime.now()
         else:
-            increment_date = datetime.strptime(increment_date, "%Y-%m-%d")
+            increment_date = parse_increment_date(increment_date)
 
         cur = db.cursor()
+        streak = self._advance_streak(self._get_streak(), increment_date)
 
-        if self.is_streak_valid(increment_date):
-            cur.execute('''INSERT INTO counter (habit_id, increment_date) VALUES (?, ?)''', (self.id, increment_date))
-        else:
-            cur.execute('''DELETE FROM counter WHERE habit_id = ?''', (self.id,))
-            cur.execute('''INSERT INTO counter (habit_id, increment_date) VALUES (?, ?)''', (self.id, increment_date))
-
-        cur.execute('''UPDATE tracker SET last_completed = ? WHERE id = ?''',
-                    (increment_date, self.id))
+        # The log is append-only; the streak itself lives on the tracker row
+        cur.execute(INSERT_COMPLETION, (self.id, increment_date, self.period_index(increment_date), streak[4]))
+        cur.execute(UPSERT_ROLLUP, (increment_date.toordinal(), self.id, 1))
+        cur.execute(INVALIDATE_CHECKPOINTS, (self.id, increment_date.toordinal()))
+        cur.execute(UPDATE_STREAK, streak + (self._next_due(streak), self.id))
         db.commit()
-        self.last_completed = increment_date
-        print(f"Habit {self.name} (ID: {self.id}) completed successfully on {increment_date}!")
+        self._set_streak(streak)
+        counter_cache.invalidate(db, self)
+        logger.info("Habit %s (ID: %s) completed successfully on %s!", self.name, self.id, increment_date)
+
+    @instrumented("Counter.increment_many")
+    def increment_many(self, db, dates):
+        """
+        Records many completions of the habit in a single transaction.
+
+        The dates are sorted and replayed in memory with the same streak rules as increment,
+        so the final state matches calling increment once per date in chronological order.
+
+        Args:
+            db (sqlite3.Connection): The database connection object.
+            dates (iterable): The completion dates, as YYYY-MM-DD strings or datetime objects.
+
+        Returns:
+            int: The number of completions recorded.
+        """
+        try:
+            recorded, streak = self._write_increments(db.cursor(), dates)
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            logger.error("An error occurred while completing the habit: %s", e)
+            return 0
+
+        self._set_streak(streak)
+        counter_cache.invalidate(db, self)
+        logger.info("Habit %s (ID: %s) completed %d times!", self.name, self.id, recorded)
+        return recorded
+
+    def _write_increments(self, cur, dates):
+        """
+        Writes a batch of completions without committing.
+
+        Args:
+            cur (sqlite3.Cursor): The cursor to write with.
+            dates (iterable): The completion dates, as YYYY-MM-DD strings or datetime objects.
+
+        Returns:
+            tuple: The number of completions written and the new streak state (see _get_streak).
+        """
+        dates = sorted(parse_increment_date(date) for date in dates)
+        streak = self._get_streak()
+        if not dates:
+            return 0, streak
+
+        # Replay the streak rules in memory and write the final state once
+        rows = []
+        days = {}
+        for date in dates:
+            streak = self._advance_streak(streak, date)
+            rows.append((self.id, date, self.period_index(date), streak[4]))
+            days[date.toordinal()] = days.get(date.toordinal(), 0) + 1
+
+        cur.executemany(INSERT_COMPLETION, rows)
+        cur.executemany(UPSERT_ROLLUP, [(day, self.id, completions) for day, completions in days.items()])
+        cur.execute(INVALIDATE_CHECKPOINTS, (self.id, dates[0].toordinal()))
+        cur.execute(UPDATE_STREAK, streak + (self._next_due(streak), self.id))
+        return len(dates), streak
+
+    def _get_streak(self):
+        """
+        Returns the habit's streak state.
+
+        Returns:
+            tuple: The last completed date, current streak, longest streak, streak start date and streak epoch.
+        """
+        return self.last_completed, self.current_streak, self.longest_streak, self.streak_start, self.streak_epoch
+
+    def _set_streak(self, streak):
+        """
+        Updates the habit's streak state in memory.
+
+        Args:
+            streak (tuple): The streak state, as returned by _get_streak.
+        """
+        self.last_completed, self.current_streak, self.longest_streak, self.streak_start, self.streak_epoch = streak
+
+    def _next_due(self, streak):
+        """
+        Returns the deadline of a streak state, see periodicity.next_due.
+
+        Args:
+            streak (tuple): The streak state, as returned by _get_streak.
+
+        Returns:
+            datetime: The moment the streak breaks if the habit is not completed, or None if there is no streak.
+        """
+        last_completed, current_streak = streak[:2]
+        return next_due(self.periodicity, last_completed) if current_streak and last_completed else None
+
+    def _advance_streak(self, streak, increment_date):
+        """
+        Applies one completion to a streak state.
+
+        Args:
+            streak (tuple): The streak state before the completion, as returned by _get_streak.
+            increment_date (datetime): The date of the completion.
+
+        Returns:
+            tuple: The streak state after the completion.
+        """
+        last_completed, current_streak, longest_streak, streak_start, streak_epoch = streak
+        if current_streak and self._continues_streak(last_completed, increment_date):
+            current_streak += 1
+        else:
+            # A new streak starts a new epoch, older epochs can be compacted (see compaction.py)
+            current_streak = 1
+            streak_start = increment_date
+            streak_epoch += 1
+        return increment_date, current_streak, max(longest_streak, current_streak), streak_start, streak_epoch
 
     def is_streak_valid(self, current_date):
         """
         Checks if the current date is a valid continuation of the habit streak.
 
+        A date continues the streak if it falls in the same calendar period as the last completion or in
+        the next one, e.g. the next calendar day, ISO week or month.
+
+        Args:
+            current_date (datetime): The date to check.
+
+        Returns:
+            bool: True if the date is a valid continuation, False otherwise.
+        """
+        return self._continues_streak(self.last_completed, current_date)
+
+    def _continues_streak(self, last_completed, current_date):
+        """
+        Checks if the current date continues a streak last completed on last_completed.
+
         Args:
+            last_completed (datetime): The date of the previous completion, or None.
             current_date (datetime): The date to check.
 
         Returns:
             bool: True if the date is a valid continuation, False otherwise.
         """
-        if not self.last_completed:
+        periodicity = find_periodicity(self.periodicity)
+        if not last_completed or periodicity is None:
             return False
 
-        if self.periodicity == "daily":
-            return (current_date - self.last_completed) <= timedelta(days=1)
-        elif self.periodicity == "weekly":
-            return (current_date - self.last_completed) <= timedelta(weeks=1)
-        elif self.periodicity == "monthly":
-            return (current_date - self.last_completed) <= timedelta(days=30)  #approximation
-        return False
+        return periodicity.continues(periodicity.period_index(last_completed), periodicity.period_index(current_date))
+
+    def period_index(self, value):
+        """
+        Returns the index of the habit's period that a date falls in, see periodicity.Periodicity.
+
+        Args:
+            value (datetime): The date.
+
+        Returns:
+            int: The period index, or None if the habit's periodicity is unknown.
+        """
+        periodicity = find_periodicity(self.periodicity)
+        return periodicity.period_index(value) if periodicity else None
 
+    @instrumented("Counter.reset")
     def reset(self, db):
         """
-        Resets the habit counter by deleting all entries from the counter table.
+        Resets the current streak of the habit. The completion log and longest streak are kept.
 
         Args:
             db (sqlite3.Connection): The database connection object.
         """
         try:
             cur = db.cursor()
-            cur.execute('''DELETE FROM counter WHERE habit_id = ?''', (self.id,))
+            cur.execute('''UPDATE tracker SET current_streak = 0, streak_start = NULL, next_due = NULL WHERE id = ?''', (self.id,))
             db.commit()
+            self.current_streak = 0
+            self.streak_start = None
+            counter_cache.invalidate(db, self)
         except sqlite3.IntegrityError:
-            print("Invalid counter name.")
+            logger.warning("Invalid counter name.")
 
+    @instrumented("Counter.count")
     def count(self, db):
         """
-        Counts the number of times the habit has been completed.
+        Returns the length of the habit's current streak.
 
         Args:
             db (sqlite3.Connection): The database connection object.
 
         Returns:
-            int: The number of times the habit has been completed.
+            int: The number of completions in the current streak, or 0 if the habit is not stored.
         """
         cur = db.cursor()
-        query = '''SELECT COUNT(*) FROM counter WHERE habit_id = ?'''
+        query = '''SELECT current_streak FROM tracker WHERE id = ?'''
         cur.execute(query, (self.id,))
-        result = cur.fetchone()[0]
-        return result
+        result = cur.fetchone()
+        return result[0] if result else 0
 
+    @instrumented("Counter.remove")
     def remove(self, db):
         """
-        Removes the habit from the tracker and counter tables.
+        Removes the habit from the tracker and counter tables, by ID, or by name if the Counter has no ID.
 
         Args:
             db (sqlite3.Connection): The database connection object.
@@ -143,9 +423,14 @@ class Counter:
 
         try:
             cur = db.cursor()
-            cur.execute('''DELETE FROM tracker WHERE name = ?''', (self.name,))
-            cur.execute('''DELETE FROM counter WHERE habit_id = ?''', (self.id,))
+            # The habit's completions are removed by the ON DELETE CASCADE foreign key
+            if self.id is not None:
+                cur.execute('''DELETE FROM tracker WHERE id = ?''', (self.id,))
+            else:
+                cur.execute('''DELETE FROM tracker WHERE name = ?''', (self.name,))
             db.commit()
-            print(f"Habit '{self.name}' removed successfully.")
+            counter_cache.invalidate(db, self)
+            habit_index.discard(db, self.name)
+            logger.info("Habit '%s' removed successfully.", self.name)
         except sqlite3.Error as e:
-            print(f"An error occurred while removing the habit: {e}")
+            logger.error("An error occurred while removing the habit: %s", e)
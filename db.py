@@ -1,50 +1,386 @@
 import sqlite3
 
-from counter import Counter
+from cache import counter_cache, habit_index
+from events import logger
+from instrument import instrumented
+from counter import Counter, parse_timestamp
+from periodicity import next_due, period_index
 
-def get_db(name='main.db'):
+# The most ids or names bound in one IN query, well below SQLite's limit on host parameters
+IN_CHUNK_SIZE = 500
+
+# The tracker columns needed to build a Counter, in the order expected by counter_from_row
+COUNTER_COLUMNS = '''id, name, description, periodicity, last_completed, current_streak, longest_streak, streak_start,
+                     creation_date, streak_epoch'''
+
+class Connection(sqlite3.Connection):
+    """
+    A tracker database connection; closing it also drops its entries from the in-memory caches.
+
+    The caches are keyed by connection, so without this a closed connection would stay alive in them.
+    """
+
+    def close(self):
+        counter_cache.forget(self)
+        habit_index.forget(self)
+        super().close()
+
+def counter_from_row(row):
     """
-    Connects to the SQLite database, creating tables if they don't exist.
+    Builds a Counter from a tracker row selected with COUNTER_COLUMNS.
 
     Args:
-        name (str, optional): The name of the database file. Defaults to 'main.db'.
+        row (tuple): The selected row.
 
     Returns:
-        sqlite3.Connection: The database connection object.  Returns None if connection fails.
+        Counter: The habit represented by the row.
+    """
+    (habit_id, name, description, periodicity, last_completed, current_streak, longest_streak, streak_start,
+     creation_date, streak_epoch) = row
+    return Counter(name, description, periodicity, habit_id=habit_id, last_completed=last_completed,
+                   current_streak=current_streak, longest_streak=longest_streak, streak_start=streak_start,
+                   creation_date=creation_date, streak_epoch=streak_epoch)
+
+def _migration_1(cur):
+    """
+    Creates the original tracker and counter tables.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    # Create the tracker table if it doesn't exist
+    cur.execute('''CREATE TABLE IF NOT EXISTS tracker
+                    (id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE,
+                    description TEXT,
+                    periodicity TEXT,
+                    creation_date TEXT,
+                    last_completed TEXT)''')
+
+    # Create the counter table if it doesn't exist
+    cur.execute('''CREATE TABLE IF NOT EXISTS counter
+                    (id INTEGER PRIMARY KEY,
+                    habit_id INTEGER,
+                    increment_date TEXT,
+                    FOREIGN KEY (habit_id) REFERENCES tracker(id))''')
+
+    # Check if the 'last_completed' column exists in the tracker table; if not, add it
+    cur.execute("PRAGMA table_info(tracker)")
+    columns = [column[1] for column in cur.fetchall()]
+    if 'last_completed' not in columns:
+        cur.execute("ALTER TABLE tracker ADD COLUMN last_completed TEXT")
+
+def _migration_2(cur):
+    """
+    Rebuilds both tables with typed date columns and a cascading foreign key, and indexes the completion log.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute('''CREATE TABLE tracker_new
+                    (id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE,
+                    description TEXT,
+                    periodicity TEXT,
+                    creation_date TIMESTAMP,
+                    last_completed TIMESTAMP)''')
+    cur.execute('''INSERT INTO tracker_new (id, name, description, periodicity, creation_date, last_completed)
+                    SELECT id, name, description, periodicity, creation_date, last_completed FROM tracker''')
+    cur.execute("DROP TABLE tracker")
+    cur.execute("ALTER TABLE tracker_new RENAME TO tracker")
+
+    cur.execute('''CREATE TABLE counter_new
+                    (id INTEGER PRIMARY KEY,
+                    habit_id INTEGER REFERENCES tracker(id) ON DELETE CASCADE,
+                    increment_date TIMESTAMP NOT NULL)''')
+    # Completions of habits that no longer exist are dropped, they would violate the foreign key
+    cur.execute('''INSERT INTO counter_new (id, habit_id, increment_date)
+                    SELECT id, habit_id, increment_date FROM counter
+                    WHERE habit_id IN (SELECT id FROM tracker) AND increment_date IS NOT NULL''')
+    cur.execute("DROP TABLE counter")
+    cur.execute("ALTER TABLE counter_new RENAME TO counter")
+
+    # Covers both the per-habit COUNT(*)/DELETE lookups and date ordered scans of one habit
+    cur.execute("CREATE INDEX idx_counter_habit_date ON counter (habit_id, increment_date)")
+
+def _migration_3(cur):
+    """
+    Adds the materialized streak state to the tracker table.
+
+    Until now a streak break deleted the habit's log, so the remaining completions form the current streak.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("ALTER TABLE tracker ADD COLUMN current_streak INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE tracker ADD COLUMN longest_streak INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE tracker ADD COLUMN streak_start TIMESTAMP")
+    cur.execute('''UPDATE tracker SET
+                    current_streak = (SELECT COUNT(*) FROM counter WHERE habit_id = tracker.id),
+                    longest_streak = (SELECT COUNT(*) FROM counter WHERE habit_id = tracker.id),
+                    streak_start = (SELECT MIN(increment_date) FROM counter WHERE habit_id = tracker.id)''')
+
+def _migration_4(cur):
+    """
+    Indexes habits by periodicity and name, for paging through the habits of one periodicity.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("CREATE INDEX idx_tracker_periodicity_name ON tracker (periodicity, name)")
+
+def _migration_5(cur):
+    """
+    Stores the period index of every completion, so streak continuity can be compared as integers.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("ALTER TABLE counter ADD COLUMN period_index INTEGER")
+    cur.execute('''SELECT counter.id, counter.increment_date, tracker.periodicity
+                    FROM counter JOIN tracker ON tracker.id = counter.habit_id''')
+    updates = [(period_index(periodicity, parse_timestamp(increment_date)), completion_id)
+               for completion_id, increment_date, periodicity in cur.fetchall()]
+    cur.executemany("UPDATE counter SET period_index = ? WHERE id = ?", updates)
+    cur.execute("CREATE INDEX idx_counter_habit_period ON counter (habit_id, period_index)")
+
+def _migration_6(cur):
+    """
+    Numbers the streaks of every habit (epochs) and adds the archive that old epochs are compacted into.
+
+    Existing completions are assigned to epochs by replaying them in the order they were logged.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("ALTER TABLE counter ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE tracker ADD COLUMN streak_epoch INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE tracker ADD COLUMN compacted_epoch INTEGER NOT NULL DEFAULT 0")
+
+    cur.execute('''SELECT id, habit_id, period_index FROM counter ORDER BY habit_id, id''')
+    updates = []
+    epochs = {}
+    last_habit_id = last_period = None
+    for completion_id, habit_id, period in cur.fetchall():
+        continues = (habit_id == last_habit_id and period is not None and last_period is not None
+                     and period - last_period <= 1)
+        epochs[habit_id] = epochs.get(habit_id, 0) + (0 if continues else 1)
+        updates.append((epochs[habit_id], completion_id))
+        last_habit_id, last_period = habit_id, period
+    cur.executemany("UPDATE counter SET epoch = ? WHERE id = ?", updates)
+    cur.executemany("UPDATE tracker SET streak_epoch = ? WHERE id = ?", [(epoch, habit_id) for habit_id, epoch in epochs.items()])
+    cur.execute("CREATE INDEX idx_counter_habit_epoch ON counter (habit_id, epoch)")
+
+    cur.execute('''CREATE TABLE streak_archive
+                    (habit_id INTEGER NOT NULL REFERENCES tracker(id) ON DELETE CASCADE,
+                    epoch INTEGER NOT NULL,
+                    first_completed TIMESTAMP NOT NULL,
+                    last_completed TIMESTAMP NOT NULL,
+                    first_period INTEGER,
+                    last_period INTEGER,
+                    completions INTEGER NOT NULL,
+                    PRIMARY KEY (habit_id, epoch)) WITHOUT ROWID''')
+
+def _migration_7(cur):
+    """
+    Adds daily completion counts per habit, so time-range analyses read one row per habit and day.
+
+    Days are proleptic Gregorian ordinals, as in datetime.toordinal. Completions already compacted
+    into the streak archive cannot be counted per day and are left out.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute('''CREATE TABLE completion_rollup
+                    (day INTEGER NOT NULL,
+                    habit_id INTEGER NOT NULL REFERENCES tracker(id) ON DELETE CASCADE,
+                    completions INTEGER NOT NULL,
+                    PRIMARY KEY (day, habit_id)) WITHOUT ROWID''')
+    # julianday of a date is an exact half-integer, and 0001-01-01 (ordinal 1) is Julian day 1721425.5
+    cur.execute('''INSERT INTO completion_rollup (day, habit_id, completions)
+                    SELECT CAST(julianday(date(increment_date)) - 1721424.5 AS INTEGER) AS day, habit_id, COUNT(*)
+                    FROM counter GROUP BY day, habit_id''')
+    cur.execute("CREATE INDEX idx_completion_rollup_habit ON completion_rollup (habit_id)")
+
+def _migration_8(cur):
+    """
+    Adds periodic streak checkpoints, so streaks as of a past date replay a few periods instead of the full history.
+
+    Checkpoints are derived from the daily rollups and built on demand by history.build_checkpoints.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute('''CREATE TABLE streak_checkpoint
+                    (habit_id INTEGER NOT NULL REFERENCES tracker(id) ON DELETE CASCADE,
+                    day INTEGER NOT NULL,
+                    last_period INTEGER,
+                    current_streak INTEGER NOT NULL,
+                    longest_streak INTEGER NOT NULL,
+                    PRIMARY KEY (habit_id, day)) WITHOUT ROWID''')
+
+def _migration_9(cur):
+    """
+    Stores the deadline of every habit's streak, indexed, so habits that are about to break their streak
+    are found without loading every habit (see scheduler.py).
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("ALTER TABLE tracker ADD COLUMN next_due TIMESTAMP")
+    cur.execute('''SELECT id, periodicity, last_completed FROM tracker
+                    WHERE current_streak > 0 AND last_completed IS NOT NULL''')
+    deadlines = [(next_due(periodicity, parse_timestamp(last_completed)), habit_id)
+                 for habit_id, periodicity, last_completed in cur.fetchall()]
+    cur.executemany("UPDATE tracker SET next_due = ? WHERE id = ?", deadlines)
+    cur.execute("CREATE INDEX idx_tracker_next_due ON tracker (next_due)")
+
+def _migration_10(cur):
+    """
+    Drops the index on the period index of completions. No query filters or sorts by the period index,
+    which is only read alongside the rest of a completion, so the index only slowed down every completion.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor to run the migration with.
+    """
+    cur.execute("DROP INDEX IF EXISTS idx_counter_habit_period")
+
+# Schema migrations in order; the database's user_version records how many have been applied
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6, _migration_7,
+              _migration_8, _migration_9, _migration_10]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(db):
     """
+    Reads the schema version stored in the database file.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+
+    Returns:
+        int: The number of migrations applied to the database.
+    """
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+@instrumented("migrate")
+def migrate(db, target=SCHEMA_VERSION):
+    """
+    Upgrades the database schema in place by applying every pending migration up to target.
+
+    Each migration runs in its own transaction together with the user_version update,
+    so an interrupted upgrade leaves the database at the last completed version.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        target (int, optional): The schema version to upgrade to. Defaults to SCHEMA_VERSION.
+
+    Returns:
+        int: The schema version of the database after migrating.
+    """
+    version = get_schema_version(db)
+    if version >= target:
+        return version
+
+    if version == 0 and not db.execute("SELECT 1 FROM sqlite_master").fetchone():
+        # A new database, so compaction can free pages incrementally; VACUUM applies it to the empty file
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+
+    # Table rebuilds must not trigger foreign key actions; this pragma is ignored inside a transaction
+    db.execute("PRAGMA foreign_keys = OFF")
     try:
-        db = sqlite3.connect(name)
-        cur = db.cursor()
+        for number in range(version + 1, target + 1):
+            cur = db.cursor()
+            cur.execute("BEGIN")
+            try:
+                MIGRATIONS[number - 1](cur)
+                cur.execute(f"PRAGMA user_version = {number}")
+                db.commit()
+            except Exception:  # Also a completion date a migration cannot parse, which is not an sqlite3.Error
+                db.rollback()
+                raise
+    finally:
+        db.execute("PRAGMA foreign_keys = ON")
 
-        # Create the tracker table if it doesn't exist
-        cur.execute('''CREATE TABLE IF NOT EXISTS tracker
-                        (id INTEGER PRIMARY KEY,
-                        name TEXT UNIQUE,
-                        description TEXT,
-                        periodicity TEXT,
-                        creation_date TEXT,
-                        last_completed TEXT)''')
-
-        # Create the counter table if it doesn't exist
-        cur.execute('''CREATE TABLE IF NOT EXISTS counter
-                        (id INTEGER PRIMARY KEY,
-                        habit_id INTEGER,
-                        increment_date TEXT,
-                        FOREIGN KEY (habit_id) REFERENCES tracker(id))''')
-
-        # Check if the 'last_completed' column exists in the tracker table; if not, add it
-        cur.execute("PRAGMA table_info(tracker)")
-        columns = [column[1] for column in cur.fetchall()]
-        if 'last_completed' not in columns:
-            cur.execute("ALTER TABLE tracker ADD COLUMN last_completed TEXT")
+    return target
 
-        db.commit()
+# SQLite settings for each performance profile:
+# 'durable' syncs every commit to disk, 'balanced' may lose the last commits on power loss but never corrupts,
+# and 'bulk' skips syncing entirely for loads and analyses that can be rerun
+PROFILES = {
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'mmap_size': 0,
+                'cache_size': -2000, 'temp_store': 'DEFAULT'},
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 256 * 1024 * 1024,
+                 'cache_size': -64 * 1024, 'temp_store': 'MEMORY'},
+    'bulk': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'mmap_size': 1024 * 1024 * 1024,
+             'cache_size': -256 * 1024, 'temp_store': 'MEMORY'},
+}
+
+def apply_profile(db, profile):
+    """
+    Applies a performance profile to an open connection.
+
+    The journal mode is stored in the database file; the other settings only affect this connection.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        profile (str): The name of the profile in PROFILES.
+
+    Raises:
+        ValueError: If the profile does not exist.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}'. Choose from: {', '.join(PROFILES)}")
+
+    for setting, value in PROFILES[profile].items():
+        db.execute(f"PRAGMA {setting} = {value}")
+
+def get_db_settings(db):
+    """
+    Reports the performance settings active on a connection.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+
+    Returns:
+        dict: The current value of every setting a profile controls.
+    """
+    return {setting: db.execute(f"PRAGMA {setting}").fetchone()[0] for setting in PROFILES['durable']}
+
+@instrumented("get_db")
+def get_db(name='main.db', profile='durable', check_same_thread=True):
+    """
+    Connects to the SQLite database, creating or upgrading the tables if needed.
+
+    Args:
+        name (str, optional): The name of the database file. Defaults to 'main.db'.
+        profile (str, optional): The performance profile to apply, see PROFILES. Defaults to 'durable'.
+        check_same_thread (bool, optional): Whether only the creating thread may use the connection. Defaults to True.
+
+    Returns:
+        sqlite3.Connection: The database connection object.  Returns None if connection fails.
+
+    Raises:
+        ValueError: If the profile does not exist.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}'. Choose from: {', '.join(PROFILES)}")
+
+    db = None
+    try:
+        db = sqlite3.connect(name, check_same_thread=check_same_thread, factory=Connection)
+        db.execute("PRAGMA foreign_keys = ON")
+        apply_profile(db, profile)
+        migrate(db)
         return db
 
-    except sqlite3.Error as e:
-        print(f"Error connecting to database: {e}")
+    except (sqlite3.Error, ValueError) as e:  # ValueError: stored data a migration cannot convert
+        logger.error("Error connecting to database: %s", e)
+        if db is not None:
+            db.close()
         return None  # Important: Return None to indicate failure
 
+@instrumented("add_habit")
 def add_habit(db, name, description, periodicity):
     """
     Adds a new habit to the tracker table.
@@ -65,12 +401,16 @@ def add_habit(db, name, description, periodicity):
         cur = db.cursor()
         cur.execute('''INSERT INTO tracker (name, description, periodicity) VALUES (?, ?, ?)''', (name, description, periodicity))
         db.commit()
+        habit_index.add(db, cur.lastrowid, name)
     except sqlite3.Error as e:
-        print(f"Error adding habit: {e}")
+        logger.error("Error adding habit: %s", e)
 
+@instrumented("get_habits")
 def get_habits(db):
     """
-    Retrieves a list of all habit names from the tracker table.
+    Retrieves a list of all habit names from the tracker table, in name order.
+
+    Use iter_habits to go through a large tracker without loading every name at once.
 
     Args:
         db (sqlite3.Connection): The database connection object.
@@ -79,9 +419,10 @@ def get_habits(db):
         list: A list of habit names (strings).
     """
     cur = db.cursor()
-    cur.execute("SELECT name FROM tracker")
+    cur.execute("SELECT name FROM tracker ORDER BY name")
     return [row[0] for row in cur.fetchall()]
 
+@instrumented("get_habits_periodicity")
 def get_habits_periodicity(db, periodicity):
     """
     Retrieves a list of habit names with a specific periodicity.
@@ -94,14 +435,99 @@ def get_habits_periodicity(db, periodicity):
         list: A list of habit names (strings) with the specified periodicity.
     """
     cur = db.cursor()
-    cur.execute('''SELECT name FROM tracker WHERE periodicity = ?''', (periodicity,))
+    cur.execute('''SELECT name FROM tracker WHERE periodicity = ? ORDER BY name''', (periodicity,))
     rows = cur.fetchall()
     return [row[0] for row in rows]
 
+def get_periodicities(db):
+    """
+    Retrieves the distinct periodicities of the stored habits, in order.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+
+    Returns:
+        list: A list of periodicities (strings), e.g. ['daily', 'every 3 days', 'weekly'].
+    """
+    cur = db.cursor()
+    cur.execute('''SELECT DISTINCT periodicity FROM tracker ORDER BY periodicity''')  # Reads idx_tracker_periodicity_name
+    return [row[0] for row in cur.fetchall()]
+
+@instrumented("get_habit_page")
+def get_habit_page(db, after=None, prefix=None, search=None, periodicity=None, page_size=50):
+    """
+    Retrieves one page of habit names in name order.
+
+    Pages are found by name (keyset pagination) rather than by offset, so every page costs the same
+    however far into the list it is.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        after (str, optional): The last name of the previous page. Defaults to None (first page).
+        prefix (str, optional): Only include names starting with this text. Defaults to None.
+        search (str, optional): Only include names containing this text, ignoring case. Defaults to None.
+        periodicity (str, optional): Only include habits with this periodicity. Defaults to None.
+        page_size (int, optional): The maximum number of names on the page. Defaults to 50.
+
+    Returns:
+        list: Up to page_size habit names (strings).
+    """
+    conditions = []
+    params = []
+    if after is not None:
+        conditions.append("name > ?")
+        params.append(after)
+    if prefix:
+        # A range on name can use the index, unlike LIKE 'prefix%'
+        conditions.append("name >= ? AND name < ?")
+        params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if periodicity is not None:
+        conditions.append("periodicity = ?")
+        params.append(periodicity)
+
+    query = '''SELECT name FROM tracker'''
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY name LIMIT ?"
+    params.append(page_size)
+
+    cur = db.cursor()
+    cur.execute(query, params)
+    return [row[0] for row in cur.fetchall()]
+
+def iter_habits(db, prefix=None, search=None, periodicity=None, page_size=100):
+    """
+    Yields habit names in name order, fetching them one page at a time.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        prefix (str, optional): Only include names starting with this text. Defaults to None.
+        search (str, optional): Only include names containing this text, ignoring case. Defaults to None.
+        periodicity (str, optional): Only include habits with this periodicity. Defaults to None.
+        page_size (int, optional): The number of names fetched per query. Defaults to 100.
+
+    Yields:
+        str: The next habit name.
+    """
+    after = None
+    while True:
+        page = get_habit_page(db, after, prefix, search, periodicity, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+@instrumented("get_streak_counter")
 def get_streak_counter(db, name):
     """
     Retrieves a Counter object from the database based on the habit name.
 
+    If the counter cache is enabled, a cached Counter is returned without querying the database.
+
     Args:
         db (sqlite3.Connection): The database connection object.
         name (str): The name of the habit.
@@ -109,11 +535,113 @@ def get_streak_counter(db, name):
     Returns:
         Counter: A Counter object representing the habit, or None if the habit is not found.
     """
+    habit = counter_cache.get(db, name=name)
+    if habit is not None:
+        return habit
+
+    if habit_index.enabled:
+        habit_id = get_habit_ids(db, [name]).get(name)
+        if habit_id is None:
+            return None
+        habit = _load_counter_by_id(db, habit_id)  # The cache already missed this habit above
+        if habit is not None and habit.name == name:
+            return habit
+        habit_index.discard(db, name)  # Changed through another connection, so look the name up again
+
     cur = db.cursor()
-    cur.execute('''SELECT * FROM tracker WHERE name = ?''', (name,))
+    cur.execute('''SELECT ''' + COUNTER_COLUMNS + ''' FROM tracker WHERE name = ?''', (name,))
     habit_data = cur.fetchone()
 
     if habit_data:
-        return Counter(habit_data[1], habit_data[2], habit_data[3], habit_id=habit_data[0], last_completed=habit_data[5])
+        habit = counter_from_row(habit_data)
+        counter_cache.put(db, habit)
+        return habit
     else:
         return None
+
+@instrumented("get_counter_by_id")
+def get_counter_by_id(db, habit_id):
+    """
+    Retrieves a Counter object from the database by habit ID.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_id (int): The ID of the habit.
+
+    Returns:
+        Counter: A Counter object representing the habit, or None if the habit is not found.
+    """
+    habit = counter_cache.get(db, habit_id=habit_id)
+    if habit is not None:
+        return habit
+    return _load_counter_by_id(db, habit_id)
+
+def _load_counter_by_id(db, habit_id):
+    """
+    Reads a habit by ID from the database, bypassing the cache lookup, and caches it.
+    """
+    cur = db.cursor()
+    cur.execute('''SELECT ''' + COUNTER_COLUMNS + ''' FROM tracker WHERE id = ?''', (habit_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    habit = counter_from_row(row)
+    counter_cache.put(db, habit)
+    return habit
+
+@instrumented("get_counters")
+def get_counters(db, ids):
+    """
+    Retrieves the Counter objects of many habits with one IN query per IN_CHUNK_SIZE ids.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        ids (iterable): The habit IDs.
+
+    Returns:
+        dict: A dictionary mapping each found habit ID to its Counter; unknown IDs are left out.
+    """
+    counters = {}
+    missing = []
+    for habit_id in dict.fromkeys(ids):  # Without duplicates, in order
+        habit = counter_cache.get(db, habit_id=habit_id)
+        if habit is not None:
+            counters[habit_id] = habit
+        else:
+            missing.append(habit_id)
+
+    cur = db.cursor()
+    for start in range(0, len(missing), IN_CHUNK_SIZE):
+        chunk = missing[start:start + IN_CHUNK_SIZE]
+        cur.execute('''SELECT ''' + COUNTER_COLUMNS + ''' FROM tracker WHERE id IN (''' + ', '.join('?' * len(chunk)) + ')', chunk)
+        for row in cur.fetchall():
+            habit = counter_from_row(row)
+            counter_cache.put(db, habit)
+            counters[habit.id] = habit
+    return counters
+
+@instrumented("get_habit_ids")
+def get_habit_ids(db, names):
+    """
+    Resolves habit names to IDs, from the habit index if it is enabled and otherwise with IN queries.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        names (iterable): The habit names.
+
+    Returns:
+        dict: A dictionary mapping each found habit name to its ID; unknown names are left out.
+    """
+    names = list(dict.fromkeys(names))
+    ids = habit_index.resolve(db, names) or {}
+
+    # Names the index does not know may have been added through another connection
+    missing = [name for name in names if name not in ids]
+    cur = db.cursor()
+    for start in range(0, len(missing), IN_CHUNK_SIZE):
+        chunk = missing[start:start + IN_CHUNK_SIZE]
+        cur.execute('''SELECT name, id FROM tracker WHERE name IN (''' + ', '.join('?' * len(chunk)) + ')', chunk)
+        for name, habit_id in cur.fetchall():
+            ids[name] = habit_id
+            habit_index.add(db, habit_id, name)
+    return ids
@@ -0,0 +1,108 @@
+import atexit
+import logging
+import random
+
+# The logger every tracker module reports to; applications can also attach their own handlers
+logger = logging.getLogger("habit_tracker")
+# Above every level, so no message passes
+QUIET = logging.CRITICAL + 1
+
+class _SampleFilter(logging.Filter):
+    """
+    Passes a share of the records below WARNING; warnings and errors always pass.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+class _ConsoleHandler(logging.Handler):
+    """
+    Prints messages to the current sys.stdout, as the tracker's print calls did.
+    """
+
+    def emit(self, record):
+        try:
+            print(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+_listener = None
+_handler = None
+
+def _deferred_queue_handler(records):
+    """
+    Creates a queue handler that puts records on the queue unformatted, so formatting happens on the listener thread.
+
+    The tracker only logs strings, numbers and dates, which stay valid when formatted later.
+
+    Args:
+        records (queue.SimpleQueue): The queue the listener reads.
+
+    Returns:
+        logging.handlers.QueueHandler: The handler.
+    """
+    from logging.handlers import QueueHandler
+
+    class _DeferredQueueHandler(QueueHandler):
+        def prepare(self, record):
+            return record
+
+    return _DeferredQueueHandler(records)
+
+def configure(level=logging.INFO, sample_rate=1.0, handlers=None):
+    """
+    Sends the tracker's messages through a queue to a background thread that formats and writes them.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level (int, optional): The lowest level shown. Defaults to logging.INFO; QUIET shows nothing.
+        sample_rate (float, optional): The share of messages below WARNING that are shown. Defaults to 1.0.
+        handlers (list, optional): The handlers that write the messages. Defaults to printing them to stdout.
+    """
+    global _listener, _handler
+    # Imported here: logging.handlers is slow to import and only needed once messages are shown
+    from logging.handlers import QueueListener
+    from queue import SimpleQueue
+    shutdown()
+
+    records = SimpleQueue()
+    _handler = _deferred_queue_handler(records)
+    if sample_rate < 1:
+        _handler.addFilter(_SampleFilter(sample_rate))
+    _listener = QueueListener(records, *(handlers or [_ConsoleHandler()]))
+    _listener.start()
+
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    logger.propagate = False  # The root logger's handlers would write every message a second time
+
+def silence():
+    """
+    Drops all tracker messages, e.g. for batch jobs. Messages are then discarded before they are formatted.
+    """
+    logger.setLevel(QUIET)
+
+def flush():
+    """
+    Waits until every queued message is written, e.g. before an interactive prompt is shown.
+    """
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+def shutdown():
+    """
+    Writes the queued messages and stops the background thread.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()  # Waits until every queued message is written
+        logger.removeHandler(_handler)
+        _listener = _handler = None
+
+atexit.register(shutdown)
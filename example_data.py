@@ -1,13 +1,15 @@
 from datetime import datetime, timedelta
 import random
-from counter import Counter
+from counter import Counter, import_completions
 from db import get_db, get_streak_counter, add_habit
+import events
+from events import logger
 
 def example_data():
     """
     Populates the database with example habit data, including random completion dates for the past 4 weeks.
     """
-    db = get_db()
+    db = get_db(profile='bulk')  # The example data can simply be loaded again, so skip syncing to disk
     cur = db.cursor()
 
     # Add example habits to the database
@@ -19,29 +21,79 @@ def example_data():
 
     habits = ["Study", "Laundry", "Journaling", "Vacuum", "Dishes"]
 
-    # Iterate through each habit and add completion data for the past 4 weeks
+    completions = []
+
+    # Iterate through each habit and collect completion dates for the past 4 weeks
     for habit_name in habits:
         habit = get_streak_counter(db, habit_name)
         if habit:
             today = datetime.now()
+            dates = []
             for i in range(4):  # 4 weeks
                 if habit.periodicity == "daily":
                     increment_date = today - timedelta(days=i)
                     # Add a random chance to skip a day (75% chance of completion)
                     if random.random() < 0.75:
-                        habit.increment(db, increment_date.strftime("%Y-%m-%d"))
+                        dates.append(increment_date.strftime("%Y-%m-%d"))
                 elif habit.periodicity == "weekly":
                     increment_date = today - timedelta(weeks=i)
                     # Add a random chance to skip a week (80% chance of completion)
                     if random.random() < 0.8:
-                        habit.increment(db, increment_date.strftime("%Y-%m-%d"))
+                        dates.append(increment_date.strftime("%Y-%m-%d"))
                 elif habit.periodicity == "monthly":
                     # Incrementing monthly habits every 30 days
                     increment_date = today - timedelta(days=i * 30)
                     # Add a random chance to skip a month (70% chance of completion)
                     if random.random() < 0.7:
-                        habit.increment(db, increment_date.strftime("%Y-%m-%d"))
+                        dates.append(increment_date.strftime("%Y-%m-%d"))
+            completions.append((habit, dates))
         else:
-            print(f"Habit '{habit_name}' not found in the database.")
+            logger.warning("Habit '%s' not found in the database.", habit_name)
+
+    # Write all completions in one transaction
+    import_completions(db, completions)
+
+def generate_data(db, habits, days, end_date=None, seed=None):
+    """
+    Populates the database with synthetic habits and random completions, for tests and benchmarks.
+
+    Habits cycle through the daily, weekly and monthly periodicities and are completed with the
+    same chances as the example data: 75% per day, 80% per week and 70% per 30 days.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habits (int): The number of habits to create.
+        days (int): The number of days of history to generate, ending at end_date.
+        end_date (datetime, optional): The last day of the history. Defaults to today.
+        seed (int, optional): The seed for the random generator, for reproducible data. Defaults to None.
+
+    Returns:
+        list: The names of the generated habits.
+    """
+    rng = random.Random(seed)
+    if end_date is None:
+        end_date = datetime.now()
+
+    periodicities = [("daily", 1, 0.75), ("weekly", 7, 0.8), ("monthly", 30, 0.7)]
+    names = [f"habit_{i}" for i in range(habits)]
+    completions = []
+
+    # Add the habits in one transaction, add_habit would commit once per habit
+    cur = db.cursor()
+    cur.executemany('''INSERT INTO tracker (name, description, periodicity) VALUES (?, ?, ?)''',
+                    [(name, f"Generated habit {i}", periodicities[i % len(periodicities)][0]) for i, name in enumerate(names)])
+    db.commit()
+
+    for i, name in enumerate(names):
+        periodicity, step, chance = periodicities[i % len(periodicities)]
+        habit = get_streak_counter(db, name)
+        dates = [(end_date - timedelta(days=day)).strftime("%Y-%m-%d")
+                 for day in range(0, days, step) if rng.random() < chance]
+        completions.append((habit, dates))
+
+    import_completions(db, completions)
+    return names
 
-example_data()
+if __name__ == '__main__':
+    events.configure()  # Show the import summary
+    example_data()
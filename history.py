@@ -0,0 +1,247 @@
+from datetime import datetime
+
+from db import COUNTER_COLUMNS, counter_from_row
+from events import logger
+from instrument import instrumented
+from periodicity import find_periodicity
+
+# The number of periods between two checkpoints of a habit; a past streak replays at most this many periods
+CHECKPOINT_PERIODS = 16
+
+def _replay(engine, state, rollups):
+    """
+    Applies daily completion counts, oldest day first, to a streak state.
+
+    Args:
+        engine (Periodicity): The periodicity of the habit.
+        state (tuple): The (last period, current streak, longest streak) before the first day.
+        rollups (iterable): (day ordinal, completions) tuples.
+
+    Returns:
+        tuple: The (last period, current streak, longest streak) after the last day.
+    """
+    last_period, current_streak, longest_streak = state
+    for day, completions in rollups:
+        period = engine.period_index(datetime.fromordinal(day))
+        if current_streak and engine.continues(last_period, period):
+            current_streak += completions
+        else:
+            current_streak = completions
+        last_period = period
+        longest_streak = max(longest_streak, current_streak)
+    return last_period, current_streak, longest_streak
+
+def _get_checkpoints(db, day, habit_ids=None):
+    """
+    Reads the latest checkpoint on or before a day of every habit that has one.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        day (int): The day ordinal.
+        habit_ids (list, optional): Only read these habits. Defaults to None (all habits).
+
+    Returns:
+        dict: A dictionary where keys are habit IDs and values are (day, state) tuples.
+    """
+    cur = db.cursor()
+    query = '''SELECT c.habit_id, c.day, c.last_period, c.current_streak, c.longest_streak
+               FROM streak_checkpoint c
+               JOIN (SELECT habit_id, MAX(day) AS day FROM streak_checkpoint WHERE day <= ? GROUP BY habit_id) latest
+               ON c.habit_id = latest.habit_id AND c.day = latest.day'''
+    params = (day,)
+    if habit_ids is not None:
+        query += f''' WHERE c.habit_id IN ({', '.join('?' * len(habit_ids))})'''
+        params += tuple(habit_ids)
+    cur.execute(query, params)
+    return {habit_id: (checkpoint_day, tuple(state)) for habit_id, checkpoint_day, *state in cur.fetchall()}
+
+@instrumented("build_checkpoints")
+def build_checkpoints(db, habit_ids=None, every=CHECKPOINT_PERIODS, now=None):
+    """
+    Writes the missing streak checkpoints of habits, continuing from each habit's latest checkpoint.
+
+    A checkpoint is written at the start of every `every`-th period and holds the streak state from all
+    completions before that day. Completions recorded on an earlier day drop the checkpoints after it
+    (see Counter.increment), so the next call rebuilds them. This is a maintenance write that commits;
+    compact() runs it, and the as-of queries only read the checkpoints that exist.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_ids (list, optional): Only build checkpoints for these habits. Defaults to None (all habits).
+        every (int, optional): The number of periods between checkpoints. Defaults to CHECKPOINT_PERIODS.
+        now (datetime, optional): Checkpoints are written up to this date. Defaults to the current time.
+
+    Returns:
+        int: The number of checkpoints written.
+    """
+    today = (now or datetime.now()).toordinal()
+    cur = db.cursor()
+    query = '''SELECT id, periodicity FROM tracker'''
+    params = ()
+    if habit_ids is not None:
+        query += f''' WHERE id IN ({', '.join('?' * len(habit_ids))})'''
+        params = tuple(habit_ids)
+    cur.execute(query, params)
+    habits = cur.fetchall()
+    latest = _get_checkpoints(db, today, habit_ids)
+
+    checkpoints = []
+    for habit_id, periodicity in habits:
+        engine = find_periodicity(periodicity)
+        if engine is None:
+            continue
+
+        if habit_id in latest:
+            first_day, state = latest[habit_id]
+            boundary = engine.period_index(datetime.fromordinal(first_day))
+        else:
+            first_day, state = 0, (None, 0, 0)
+            cur.execute('''SELECT MIN(day) FROM completion_rollup WHERE habit_id = ?''', (habit_id,))
+            first_completed = cur.fetchone()[0]
+            if first_completed is None or first_completed > today:
+                continue
+            boundary = engine.period_index(datetime.fromordinal(first_completed))
+        boundary = (boundary // every + 1) * every
+        boundary_day = engine.period_start(boundary).toordinal()
+
+        cur.execute('''SELECT day, completions FROM completion_rollup WHERE habit_id = ? AND day >= ? AND day < ?
+                       ORDER BY day''', (habit_id, first_day, today))
+        # The checkpoints after the last completion hold the same state
+        for day, completions in cur.fetchall() + [(today, 0)]:
+            while boundary_day <= day:
+                checkpoints.append((habit_id, boundary_day) + state)
+                boundary += every
+                boundary_day = engine.period_start(boundary).toordinal()
+            if completions:
+                state = _replay(engine, state, [(day, completions)])
+
+    cur.executemany('''INSERT OR REPLACE INTO streak_checkpoint
+                       (habit_id, day, last_period, current_streak, longest_streak) VALUES (?, ?, ?, ?, ?)''',
+                    checkpoints)
+    db.commit()
+    if checkpoints:
+        logger.debug("Wrote %d streak checkpoints.", len(checkpoints))
+    return len(checkpoints)
+
+def _streaks_as_of(db, date, habit_ids=None):
+    """
+    Replays the streaks of habits up to the end of a day, each from its latest checkpoint on or before it.
+
+    Only reads: habits without a checkpoint yet replay from their first completion.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        date (datetime): The day.
+        habit_ids (list, optional): Only replay these habits. Defaults to None (all habits).
+
+    Returns:
+        dict: A dictionary where keys are habit IDs and values are (Counter, current streak, longest streak) tuples.
+    """
+    day = date.toordinal()
+    cur = db.cursor()
+    query = '''SELECT ''' + COUNTER_COLUMNS + ''' FROM tracker'''
+    params = ()
+    if habit_ids is not None:
+        query += f''' WHERE id IN ({', '.join('?' * len(habit_ids))})'''
+        params = tuple(habit_ids)
+    cur.execute(query + ''' ORDER BY name''', params)
+    habits = [counter_from_row(row) for row in cur.fetchall()]
+    checkpoints = _get_checkpoints(db, day, habit_ids)
+
+    # The days after each habit's checkpoint; CROSS JOIN keeps the habits outer, so each reads its rollup index range
+    query = '''SELECT r.habit_id, r.day, r.completions FROM tracker t
+               LEFT JOIN (SELECT habit_id, MAX(day) AS day FROM streak_checkpoint WHERE day <= ? GROUP BY habit_id) c
+               ON c.habit_id = t.id
+               CROSS JOIN completion_rollup r ON r.habit_id = t.id AND r.day >= COALESCE(c.day, 0) AND r.day <= ?'''
+    params = (day, day)
+    if habit_ids is not None:
+        query += f''' WHERE t.id IN ({', '.join('?' * len(habit_ids))})'''
+        params += tuple(habit_ids)
+    cur.execute(query + ''' ORDER BY r.day''', params)
+    rollups = {}
+    for habit_id, rollup_day, completions in cur.fetchall():
+        rollups.setdefault(habit_id, []).append((rollup_day, completions))
+
+    streaks = {}
+    for habit in habits:
+        engine = find_periodicity(habit.periodicity)
+        if engine is None:
+            streaks[habit.id] = (habit, 0, 0)
+            continue
+        checkpoint_day, state = checkpoints.get(habit.id, (0, (None, 0, 0)))
+        last_period, current_streak, longest_streak = _replay(engine, state, rollups.get(habit.id, []))
+        streaks[habit.id] = (habit, current_streak, longest_streak)
+    return streaks
+
+@instrumented("streak_as_of")
+def streak_as_of(db, habit_id, date):
+    """
+    Calculates a habit's streaks as they were at the end of a day.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_id (int): The ID of the habit.
+        date (datetime): The day.
+
+    Returns:
+        tuple: The (current streak, longest streak) at the end of the day, or None if the habit does not exist.
+    """
+    streaks = _streaks_as_of(db, date, [habit_id])
+    if habit_id not in streaks:
+        return None
+    habit, current_streak, longest_streak = streaks[habit_id]
+    return current_streak, longest_streak
+
+@instrumented("count_as_of")
+def count_as_of(db, habit_id, date):
+    """
+    Calculates a habit's current streak as Counter.count would have returned it at the end of a day.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        habit_id (int): The ID of the habit.
+        date (datetime): The day.
+
+    Returns:
+        int: The current streak at the end of the day, or None if the habit does not exist.
+    """
+    streaks = streak_as_of(db, habit_id, date)
+    return streaks[0] if streaks else None
+
+@instrumented("streak_leaderboard_as_of")
+def streak_leaderboard_as_of(db, date):
+    """
+    Ranks all habits by their current streak at the end of a day.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        date (datetime): The day.
+
+    Returns:
+        list: A list of (name, current streak, longest streak) tuples, longest current streak first.
+    """
+    streaks = _streaks_as_of(db, date).values()  # Ordered by name, which breaks ties
+    return sorted(((habit.name, current_streak, longest_streak) for habit, current_streak, longest_streak in streaks),
+                  key=lambda row: -row[1])
+
+@instrumented("calculate_longest_streak_as_of")
+def calculate_longest_streak_as_of(db, date):
+    """
+    Calculates the habit with the best (longest) current streak at the end of a day.
+
+    Like calculate_longest_streak, ties go to the first habit by name, and a habit is returned even if
+    no streak had started yet. The Counter holds the habit's stored state, not its state on that day;
+    use streak_as_of for that.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        date (datetime): The day.
+
+    Returns:
+        Counter: The habit with the best streak on that day, or None if no habits exist.
+    """
+    longest = None
+    for habit, current_streak, longest_streak in _streaks_as_of(db, date).values():
+        if longest is None or current_streak > longest[1]:
+            longest = (habit, current_streak)
+    return longest[0] if longest else None
@@ -0,0 +1,258 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+# Set to a file name (ending in .json or .prom) to record every run of the tracker and write the data on exit
+ENV_VAR = "HABIT_TRACKER_INSTRUMENT"
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+# SQLite reports progress every this many virtual machine instructions
+PROGRESS_STEPS = 1000
+
+class _Operation:
+    """
+    The statistics of one instrumented operation.
+    """
+
+    __slots__ = ('calls', 'total_ms', 'max_ms', 'buckets', 'queries', 'max_queries', 'vm_steps')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)  # The last bucket holds everything slower than BUCKETS_MS
+        self.queries = 0
+        self.max_queries = 0
+        self.vm_steps = 0
+
+class Instrumentation:
+    """
+    Records latency histograms, SQL statement counts and SQLite work per high-level tracker operation.
+
+    Statement and work counts are inclusive: a call to calculate_longest_streak also counts the queries
+    of the functions it calls, so N+1 query patterns show up as a high queries-per-call ratio. Work is
+    measured in SQLite virtual machine steps (thousands of instructions), which grow with the rows scanned.
+    """
+
+    def __init__(self):
+        """
+        Initializes a disabled Instrumentation.
+        """
+        self.enabled = False
+        self.output = None
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, output=None):
+        """
+        Starts recording.
+
+        Args:
+            output (str, optional): A .json or .prom file to write the data to when the program exits. Defaults to None.
+        """
+        self.enabled = True
+        if output and self.output is None:
+            atexit.register(self._dump_on_exit)
+        self.output = output or self.output
+
+    def disable(self):
+        """
+        Stops recording; the data recorded so far is kept.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Forgets all recorded data.
+        """
+        with self._lock:
+            self._operations.clear()
+
+    def call(self, name, db, func, args, kwargs):
+        """
+        Runs an operation and records its latency, statements and SQLite work.
+
+        Args:
+            name (str): The operation name.
+            db (sqlite3.Connection): The connection the operation uses, or None.
+            func (callable): The operation.
+            args (tuple): The positional arguments.
+            kwargs (dict): The keyword arguments.
+
+        Returns:
+            The operation's return value.
+        """
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+            self._local.hooked = {}
+
+        frame = [0, 0]  # Statements and progress steps seen during this call, including nested calls
+        frames.append(frame)
+        hooked_here = db is not None and id(db) not in self._local.hooked
+        if hooked_here:
+            self._hook(db)
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            frames.pop()
+            if hooked_here:
+                self._unhook(db)
+            self._record(name, elapsed_ms, frame[0], frame[1])
+
+    def snapshot(self):
+        """
+        Returns the recorded data.
+
+        Returns:
+            dict: For each operation name: 'calls', 'total_ms', 'mean_ms', 'max_ms', 'histogram'
+                  (bucket upper bound in ms -> calls), 'queries', 'queries_per_call', 'max_queries' and 'vm_steps'.
+        """
+        with self._lock:
+            operations = list(self._operations.items())
+
+        data = {}
+        for name, operation in sorted(operations):
+            bounds = [str(bound) for bound in BUCKETS_MS] + ['+Inf']
+            data[name] = {
+                'calls': operation.calls,
+                'total_ms': operation.total_ms,
+                'mean_ms': operation.total_ms / operation.calls,
+                'max_ms': operation.max_ms,
+                'histogram': dict(zip(bounds, operation.buckets)),
+                'queries': operation.queries,
+                'queries_per_call': operation.queries / operation.calls,
+                'max_queries': operation.max_queries,
+                'vm_steps': operation.vm_steps,
+            }
+        return data
+
+    def to_json(self):
+        """
+        Formats the recorded data as JSON.
+
+        Returns:
+            str: The JSON document.
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Formats the recorded data in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = ["# HELP habit_tracker_operation_seconds Latency of habit tracker operations.",
+                 "# TYPE habit_tracker_operation_seconds histogram"]
+        counters = [("habit_tracker_queries_total", "SQL statements run by habit tracker operations.", 'queries'),
+                    ("habit_tracker_vm_steps_total", "SQLite work of habit tracker operations, in thousands of VM instructions.", 'vm_steps')]
+        data = self.snapshot()
+
+        for name, operation in data.items():
+            label = f'operation="{name}"'
+            cumulative = 0
+            for bound, calls in operation['histogram'].items():
+                cumulative += calls
+                le = bound if bound == '+Inf' else repr(float(bound) / 1000)
+                lines.append(f'habit_tracker_operation_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"habit_tracker_operation_seconds_sum{{{label}}} {operation['total_ms'] / 1000}")
+            lines.append(f"habit_tracker_operation_seconds_count{{{label}}} {operation['calls']}")
+
+        for metric, description, key in counters:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{operation="{name}"}} {operation[key]}' for name, operation in data.items()]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the recorded data to a file, as Prometheus text if the name ends in .prom and as JSON otherwise.
+
+        Args:
+            path (str): The file name.
+        """
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def _dump_on_exit(self):
+        if self.output:
+            self.dump(self.output)
+
+    def _hook(self, db):
+        """
+        Counts the statements and SQLite work of a connection for every open frame of this thread.
+        """
+        frames = self._local.frames
+
+        def count_statement(statement):
+            for frame in frames:
+                frame[0] += 1
+
+        def count_progress():
+            for frame in frames:
+                frame[1] += 1
+            return 0  # Returning non-zero would abort the query
+
+        self._local.hooked[id(db)] = db
+        db.set_trace_callback(count_statement)
+        db.set_progress_handler(count_progress, PROGRESS_STEPS)
+
+    def _unhook(self, db):
+        del self._local.hooked[id(db)]
+        db.set_trace_callback(None)
+        db.set_progress_handler(None, PROGRESS_STEPS)
+
+    def _record(self, name, elapsed_ms, queries, vm_steps):
+        bucket = next((i for i, bound in enumerate(BUCKETS_MS) if elapsed_ms <= bound), len(BUCKETS_MS))
+        with self._lock:
+            operation = self._operations.get(name)
+            if operation is None:
+                operation = self._operations[name] = _Operation()
+            operation.calls += 1
+            operation.total_ms += elapsed_ms
+            operation.max_ms = max(operation.max_ms, elapsed_ms)
+            operation.buckets[bucket] += 1
+            operation.queries += queries
+            operation.max_queries = max(operation.max_queries, queries)
+            operation.vm_steps += vm_steps
+
+def _find_connection(args):
+    """
+    Finds the database connection among an operation's positional arguments.
+    """
+    for arg in args[:2]:  # db is the first argument of functions and the second of Counter methods
+        if hasattr(arg, 'set_trace_callback'):
+            return arg
+    return None
+
+def instrumented(name):
+    """
+    Decorates a tracker operation so it is recorded while instrumentation is enabled.
+
+    Args:
+        name (str): The operation name used in the recorded data, e.g. 'Counter.increment'.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+            return instrumentation.call(name, _find_connection(args), func, args, kwargs)
+        return wrapper
+    return decorate
+
+# The instrumentation shared by all tracker modules, switched on by the environment variable or the CLI
+instrumentation = Instrumentation()
+if os.environ.get(ENV_VAR):
+    instrumentation.enable(os.environ[ENV_VAR])
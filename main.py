@@ -1,7 +1,26 @@
-import questionary
-from counter import Counter
-from analyse import calculate_longest_streak, calculate_shortest_streak, calculate_all_streaks, calculate_longest_streak_by_periodicity
-from db import get_db, get_habits_periodicity, get_habits, get_streak_counter
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime, timedelta
+
+import events
+from cache import counter_cache, habit_index
+from counter import Counter, import_completions
+from db import get_counters, get_db, get_habit_ids, get_habit_page, get_periodicities, get_streak_counter, iter_habits
+from events import logger
+from instrument import instrumentation
+from scheduler import due_before
+
+# The number of habits shown per page in the habit pickers
+PAGE_SIZE = 20
+# Values of the extra picker entries, distinct from any habit name
+MORE_HABITS = ("more",)
+SEARCH_HABITS = ("search",)
+# The number of completions written per chunk by the batch commands
+CHUNK_SIZE = 10000
+# How far ahead the "Due soon" entry looks for streak deadlines
+DUE_SOON = timedelta(days=7)
 
 def is_supported_terminal():
     """
@@ -13,11 +32,60 @@ def is_supported_terminal():
     return True
 
 
-def cli():
+def select_habit(db, message):
+    """
+    Lets the user pick a habit one page at a time, optionally narrowing the list with a search.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        message (str): The question to show above the habits.
+
+    Returns:
+        str: The name of the selected habit, or None if there are no habits.
+    """
+    import questionary  # Imported on first use: prompt_toolkit dominates the startup time
+
+    after = None
+    search = None
+    while True:
+        page = get_habit_page(db, after=after, search=search, page_size=PAGE_SIZE + 1)  # One more shows if a next page exists
+        has_more = len(page) > PAGE_SIZE
+        page = page[:PAGE_SIZE]
+        if not page and after is None:
+            if search is None:
+                print("No habits found. Add a habit first.") #Inform user if no habits exist
+                return None
+            print(f"No habits match '{search}'.")
+            search = None
+            continue
+
+        choices = list(page)
+        if has_more:
+            choices.append(questionary.Choice("More habits...", value=MORE_HABITS))
+        choices.append(questionary.Choice("Search...", value=SEARCH_HABITS))
+        choice = questionary.select(message, choices=choices).ask()
+
+        if choice == MORE_HABITS:
+            after = page[-1]  # Continue the list after the last habit shown
+        elif choice == SEARCH_HABITS:
+            search = questionary.text("Which text should the habit name contain?").ask()
+            after = None
+        else:
+            return choice
+
+def cli(name='main.db'):
     """
     The main command-line interface function.  Handles user interaction and manages habits.
+
+    Args:
+        name (str, optional): The name of the database file. Defaults to 'main.db'.
     """
-    db = get_db()  # Get the database connection
+    import questionary  # Imported on first use: prompt_toolkit dominates the startup time
+
+    events.configure()  # Messages are written by a background thread
+    db = get_db(name)  # Get the database connection
+    counter_cache.enable()  # The CLI is the only writer to its connection, so habits can be cached between menu actions
+    habit_index.enable()  # Resolve habit names to ids in memory
 
     if not is_supported_terminal():
         print("This script requires a Windows console (e.g., cmd.exe or PowerShell). Exiting.")
@@ -25,19 +93,24 @@ def cli():
 
 
     while True:  # Main loop for the CLI
+        events.flush()  # Show the messages of the last action before the next prompt
         choice = questionary.select(
             "What do you want to do?",
-            choices=["Add Habit", "Remove Habit", "Complete Habit", "See Streak", "Analyse", "Exit"]
+            choices=["Add Habit", "Remove Habit", "Complete Habit", "See Streak", "Due Soon", "Analyse", "Exit"]
         ).ask() 
 
         if choice == "Add Habit":
             name = questionary.text("What's the name of your counter?").ask() #Get habit name from user
             desc = questionary.text("What's the description of your counter?").ask() #Get habit description
             periodicity = questionary.select(
-                "What's the periodicity of your counter?", choices=["daily", "weekly", "monthly"]
+                "What's the periodicity of your counter?", choices=["daily", "weekly", "monthly", "every N days"]
             ).ask() #Get habit periodicity
+            if periodicity == "every N days":
+                days = questionary.text("Every how many days?", validate=lambda text: text.isdigit() and int(text) > 0).ask()
+                periodicity = f"every {days} days" #Custom periodicities are stored by name, see periodicity.py
             counter = Counter(name, desc, periodicity) #Create a Counter object
             counter.store(db) #Store the counter in the database
+            events.flush() #Write the queued messages first, so they do not interleave with the confirmation
             print(f"Habit {name} added successfully!")
 
         elif choice == "Remove Habit":
@@ -49,16 +122,10 @@ def cli():
                 print(f"No habit found with name {name}") #Inform user if habit is not found
 
         elif choice == "Complete Habit":
-            habits = get_habits(db) #Get list of all habits
-            if not habits:
-                print("No habits found. Add a habit first.") #Inform user if no habits exist
+            name = select_habit(db, "Which habit would you like to complete?") #Present user with the habits page by page
+            if name is None:
                 continue  #Skip to the next iteration of the while loop
 
-            name = questionary.select(
-                "Which habit would you like to complete?",
-                choices=habits #Present user with list of habits to select
-            ).ask()
-
             habit = get_streak_counter(db, name) #Retrieve selected habit from the database
             if habit:
                 habit.increment(db) #Increment the habit counter
@@ -66,35 +133,40 @@ def cli():
                 print(f"No habit found with name {name}") #Inform user if habit is not found
 
         elif choice == "See Streak":
-            habits = get_habits(db) #Get list of all habits
-            if not habits:
-                print("No habits found. Add a habit first.") #Inform user if no habits exist
+            name = select_habit(db, "Which habit streak would you like to see?") #Present user with the habits page by page
+            if name is None:
                 continue #Skip to the next iteration of the while loop
 
-            name = questionary.select(
-                "Which habit streak would you like to see?",
-                choices=habits #Present user with list of habits to select
-            ).ask()
-
             counter = get_streak_counter(db, name) #Retrieve selected habit from the database
             if counter:
-                print(f"The current streak for {name} is {counter.count(db)}") #Display the current streak
+                print(f"The current streak for {name} is {counter.current_streak} (longest: {counter.longest_streak})") #Display the current and longest streak
             else:
                 print(f"No habit found with name {name}") #Inform user if habit is not found
 
+        elif choice == "Due Soon":
+            now = datetime.now()
+            due = due_before(db, now + DUE_SOON, since=now) #Streaks that break within the next week, soonest first
+            for habit, deadline in due:
+                print(f"{habit.name} (streak {habit.current_streak}) is due before {deadline:%Y-%m-%d %H:%M}")
+            if not due:
+                print("No streaks are due in the next 7 days.")
+
         elif choice == "Analyse":
+            from analyse import calculate_longest_streak, calculate_shortest_streak, calculate_all_streaks, calculate_longest_streak_by_periodicity, calculate_rolling_completion_rates, calculate_slipped_habits
             analysis_choice = questionary.select("What analysis would you like to do?",
-                                                 choices=["List all habits", "List habits by periodicity", "Shortest streak", "Longest streak", "All streaks", "Longest streak by periodicity", "Back"]).ask() #Present user with analysis options
+                                                 choices=["List all habits", "List habits by periodicity", "Shortest streak", "Longest streak", "All streaks", "Longest streak by periodicity", "Completion rates", "Slipped weekly habits", "Back"]).ask() #Present user with analysis options
             if analysis_choice == "List all habits":
-                habits = get_habits(db) #Retrieve all habits from the database
                 print("Habits:")
-                for habit in habits:
+                for habit in iter_habits(db): #Stream the habits from the database page by page
                     print(habit)
             elif analysis_choice == "List habits by periodicity":
-                periodicity = questionary.select("What periodicity would you like to see?", choices=["daily", "weekly", "monthly"]).ask() #Get periodicity from user
-                habits = get_habits_periodicity(db, periodicity) #Retrieve habits with selected periodicity
+                periodicities = get_periodicities(db) #Offer the periodicities the stored habits use
+                if not periodicities:
+                    print("No habits found.")
+                    continue
+                periodicity = questionary.select("What periodicity would you like to see?", choices=periodicities).ask() #Get periodicity from user
                 print(f"Habits with {periodicity} periodicity:")
-                for habit in habits:
+                for habit in iter_habits(db, periodicity=periodicity): #Stream habits with selected periodicity
                     print(habit)
             elif analysis_choice == "Shortest streak":
                 habit = calculate_shortest_streak(db)
@@ -117,9 +189,13 @@ def cli():
                 else:
                     print("No habits found.")
             elif analysis_choice == "Longest streak by periodicity":
+                periodicities = get_periodicities(db)  # Offer the periodicities the stored habits use
+                if not periodicities:
+                    print("No habits found.")
+                    continue
                 periodicity = questionary.select(
                     "What periodicity would you like to see the longest streak for?",
-                    choices=["daily", "weekly", "monthly"]
+                    choices=periodicities
                 ).ask()  # Get periodicity from user
                 longest_streak_habit = calculate_longest_streak_by_periodicity(db, periodicity)
                 if longest_streak_habit:
@@ -127,11 +203,197 @@ def cli():
                         f"The longest streak for {periodicity} habits is {longest_streak_habit.name} with a streak of {longest_streak_habit.count(db)}")
                 else:
                     print(f"No {periodicity} habits found.")  # Inform user if no habits with periodicity exist
+            elif analysis_choice == "Completion rates":
+                rates = calculate_rolling_completion_rates(db)  # Share of completed periods over the last 7, 30 and 365 days
+                for habit, windows in rates.items():
+                    print(f"{habit}: " + ", ".join(f"{rate:.0%} over {days} days" for days, rate in windows.items()))
+                if not rates:
+                    print("No habits found.")
+            elif analysis_choice == "Slipped weekly habits":
+                slipped = calculate_slipped_habits(db, "weekly")  # Weeks missed since the start of this month
+                for habit, weeks in slipped.items():
+                    print(f"{habit} missed the weeks of " + ", ".join(week.strftime("%Y-%m-%d") for week in weeks))
+                if not slipped:
+                    print("No weekly habits slipped this month.")
 
 
         elif choice == "Exit":
+            events.shutdown()
             print("Goodbye!")
             break
 
+def read_completions(lines, default_date):
+    """
+    Parses completions from CSV lines of the form habit[,YYYY-MM-DD], one line at a time.
+
+    Empty lines, lines starting with '#' and a 'habit,date' header are skipped.
+
+    Args:
+        lines (iterable): The lines, e.g. an open file or sys.stdin.
+        default_date (datetime): The date of completions without one.
+
+    Yields:
+        tuple: The habit name and the completion date.
+    """
+    for row in csv.reader(lines):
+        if not row or not row[0].strip() or row[0].startswith('#') or row[0].strip().lower() == 'habit':
+            continue
+        date = row[1].strip() if len(row) > 1 else ''
+        yield row[0].strip(), date or default_date
+
+def record_completions(db, completions, chunk_size=CHUNK_SIZE):
+    """
+    Records a stream of completions in one transaction, writing them in chunks grouped by habit.
+
+    Completions should arrive in chronological order; each chunk continues the streaks of the previous one.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        completions (iterable): Pairs of a habit name and a completion date.
+        chunk_size (int, optional): The number of completions per chunk. Defaults to CHUNK_SIZE.
+
+    Returns:
+        tuple: The number of completions recorded and the set of unknown habit names that were skipped.
+    """
+    counters = {}
+    unknown = set()
+
+    def group(rows):
+        # Resolve the names new in this chunk with one lookup, then group the dates by habit
+        new_names = {name for name, date in rows if name not in counters}
+        ids = get_habit_ids(db, new_names)
+        found = get_counters(db, ids.values())
+        for name in new_names:
+            counters[name] = found.get(ids.get(name))
+            if counters[name] is None:
+                logger.warning("No habit found with name %s", name)
+                unknown.add(name)
+
+        chunk = {}
+        for name, date in rows:
+            if counters[name] is not None:
+                chunk.setdefault(counters[name], []).append(date)
+        return chunk.items()
+
+    def chunks():
+        rows = []
+        for completion in completions:
+            rows.append(completion)
+            if len(rows) >= chunk_size:
+                yield from group(rows)
+                rows = []
+        yield from group(rows)
+
+    return import_completions(db, chunks()), unknown
+
+def print_report(db, as_json=False):
+    """
+    Prints the streak of every habit, longest first, followed by the longest and shortest streaks.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        as_json (bool, optional): Whether to print the report as JSON. Defaults to False.
+    """
+    from analyse import streak_report
+
+    report = streak_report(db)
+    if as_json:
+        json.dump({
+            'habits': [{'name': habit.name, 'periodicity': habit.periodicity, 'current_streak': streak,
+                        'longest_streak': habit.longest_streak} for habit, streak in report['leaderboard']],
+            'longest': report['longest'].name if report['longest'] else None,
+            'shortest': report['shortest'].name if report['shortest'] else None,
+            'by_periodicity': {periodicity: habit.name for periodicity, habit in report['by_periodicity'].items()},
+        }, sys.stdout, indent=2)
+        print()
+        return
+
+    for habit, streak in report['leaderboard']:
+        print(f"{streak:>6}  {habit.name} ({habit.periodicity}, longest: {habit.longest_streak})")
+    if report['longest']:
+        print(f"The habit with the longest streak is {report['longest'].name}")
+        print(f"The habit with the shortest streak is {report['shortest'].name}")
+
+def main(argv=None):
+    """
+    Runs a batch command, or the interactive interface if no command is given.
+
+    Args:
+        argv (list, optional): The command-line arguments. Defaults to None (sys.argv).
+
+    Returns:
+        int: The exit status.
+    """
+    parser = argparse.ArgumentParser(description="Track your habits and streaks.")
+    parser.add_argument('--db', default='main.db', help="the database file (default: main.db)")
+    parser.add_argument('--quiet', action='store_true', help="do not print messages in batch commands")
+    parser.add_argument('--instrument', metavar='FILE',
+                        help="record the latency and queries of every operation and write them to FILE on exit (.json or .prom)")
+    commands = parser.add_subparsers(dest='command')
+    complete = commands.add_parser('complete', help="complete habits; '-' reads habit[,date] lines from stdin")
+    complete.add_argument('habits', nargs='+', metavar='habit')
+    complete.add_argument('--date', help="the completion date as YYYY-MM-DD (default: now)")
+    import_parser = commands.add_parser('import', help="import habit,date lines from a CSV file ('-' for stdin)")
+    import_parser.add_argument('file')
+    report = commands.add_parser('report', help="print every habit's streak")
+    report.add_argument('--json', action='store_true', help="print the report as JSON")
+    export = commands.add_parser('export', help="write all habits and completions to a snapshot file")
+    export.add_argument('file')
+    restore = commands.add_parser('restore', help="load a snapshot file into a new database")
+    restore.add_argument('file')
+    args = parser.parse_args(argv)
+
+    if args.instrument:
+        instrumentation.enable(args.instrument)
+    if args.command is None:
+        cli(args.db)
+        return 0
+
+    if args.quiet:
+        events.silence()
+    else:
+        events.configure()
+    db = get_db(args.db)  # One connection per invocation
+    if db is None:
+        events.shutdown()
+        return 1
+    try:
+        if args.command == 'report':
+            print_report(db, args.json)
+            return 0
+        if args.command in ('export', 'restore'):
+            from snapshot import export_snapshot, restore_snapshot
+            try:
+                if args.command == 'export':
+                    export_snapshot(db, args.file)
+                    return 0
+                return 0 if restore_snapshot(db, args.file) else 1
+            except (ValueError, OSError) as e:  # Not a snapshot, a database that is not empty, or a missing file
+                logger.error("Could not %s the snapshot: %s", args.command, e)
+                return 1
+
+        now = datetime.now()
+        if args.command == 'complete':
+            default_date = args.date or now
+            completions = (completion for habit in args.habits
+                           for completion in (read_completions(sys.stdin, default_date) if habit == '-'
+                                              else [(habit, default_date)]))
+            recorded, unknown = record_completions(db, completions)
+        else:
+            try:
+                lines = sys.stdin if args.file == '-' else open(args.file, newline='')
+            except OSError as e:  # A missing or unreadable file
+                logger.error("Could not read %s: %s", args.file, e)
+                return 1
+            try:
+                recorded, unknown = record_completions(db, read_completions(lines, now))
+            finally:
+                if lines is not sys.stdin:
+                    lines.close()
+        return 1 if unknown or not recorded else 0
+    finally:
+        db.close()
+        events.shutdown()  # Write the queued messages before exiting
+
 if __name__ == '__main__':
-    cli() #Execute the cli function if the script is run directly
+    sys.exit(main()) #Execute the cli or a batch command if the script is run directly
@@ -0,0 +1,188 @@
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+class Periodicity(ABC):
+    """
+    Maps dates to integer period indexes, so that consecutive calendar periods have consecutive indexes.
+
+    A completion continues a streak if it falls in the same period as the previous completion or in the
+    next one, which makes streak continuity integer arithmetic on stored period indexes.
+    """
+
+    @abstractmethod
+    def period_index(self, value):
+        """
+        Returns the index of the period a date falls in.
+
+        Args:
+            value (datetime): The date.
+
+        Returns:
+            int: The period index.
+        """
+
+    @abstractmethod
+    def period_start(self, index):
+        """
+        Returns the first moment of a period.
+
+        Args:
+            index (int): The period index.
+
+        Returns:
+            datetime: The start of the period.
+        """
+
+    def continues(self, last_index, index):
+        """
+        Checks if a completion in period index continues a streak last completed in period last_index.
+
+        Args:
+            last_index (int): The period of the previous completion.
+            index (int): The period of the new completion.
+
+        Returns:
+            bool: True if the completion is in the same or the next period (or an earlier one).
+        """
+        return index - last_index <= 1
+
+class Daily(Periodicity):
+    """
+    Calendar days, indexed by their proleptic Gregorian ordinal.
+    """
+
+    def period_index(self, value):
+        return value.toordinal()
+
+    def period_start(self, index):
+        return datetime.fromordinal(index)
+
+class Weekly(Periodicity):
+    """
+    ISO weeks, Monday to Sunday, counted from the week of 0001-01-01 (a Monday).
+    """
+
+    def period_index(self, value):
+        return (value.toordinal() - 1) // 7
+
+    def period_start(self, index):
+        return datetime.fromordinal(index * 7 + 1)
+
+class Monthly(Periodicity):
+    """
+    Calendar months, indexed as year * 12 + month - 1.
+    """
+
+    def period_index(self, value):
+        return value.year * 12 + value.month - 1
+
+    def period_start(self, index):
+        return datetime(index // 12, index % 12 + 1, 1)
+
+class EveryNDays(Periodicity):
+    """
+    Fixed blocks of n days, counted from 0001-01-01.
+    """
+
+    def __init__(self, days):
+        """
+        Initializes an EveryNDays periodicity.
+
+        Args:
+            days (int): The length of each period in days.
+        """
+        if days < 1:
+            raise ValueError("A periodicity must be at least 1 day long.")
+        self.days = days
+
+    def period_index(self, value):
+        return (value.toordinal() - 1) // self.days
+
+    def period_start(self, index):
+        return datetime.fromordinal(index * self.days + 1)
+
+# The periodicity engines by name; register_periodicity adds more
+PERIODICITIES = {
+    "daily": Daily(),
+    "weekly": Weekly(),
+    "monthly": Monthly(),
+}
+
+_EVERY_N_DAYS = re.compile(r"every (\d+) days?$")
+
+def register_periodicity(name, periodicity):
+    """
+    Adds a periodicity that habits can use by name.
+
+    Args:
+        name (str): The name stored in the tracker's periodicity column.
+        periodicity (Periodicity): The engine for the name.
+    """
+    PERIODICITIES[name] = periodicity
+
+def find_periodicity(name):
+    """
+    Looks up the engine of a periodicity name, including custom 'every N days' names.
+
+    Args:
+        name (str): The periodicity name, e.g. 'daily' or 'every 3 days'.
+
+    Returns:
+        Periodicity: The engine, or None if the name is not a known periodicity.
+    """
+    periodicity = PERIODICITIES.get(name)
+    if periodicity is None and name:
+        match = _EVERY_N_DAYS.match(name)
+        if match and int(match.group(1)) > 0:
+            periodicity = PERIODICITIES[name] = EveryNDays(int(match.group(1)))
+    return periodicity
+
+def get_periodicity(name):
+    """
+    Looks up the engine of a periodicity name.
+
+    Args:
+        name (str): The periodicity name, e.g. 'daily' or 'every 3 days'.
+
+    Returns:
+        Periodicity: The engine.
+
+    Raises:
+        ValueError: If the name is not a known periodicity.
+    """
+    periodicity = find_periodicity(name)
+    if periodicity is None:
+        raise ValueError(f"Unknown periodicity '{name}'. Use daily, weekly, monthly or 'every N days'.")
+    return periodicity
+
+def period_index(name, value):
+    """
+    Returns the period index of a date for a periodicity name.
+
+    Args:
+        name (str): The periodicity name.
+        value (datetime): The date.
+
+    Returns:
+        int: The period index, or None if the periodicity is unknown.
+    """
+    periodicity = find_periodicity(name)
+    return periodicity.period_index(value) if periodicity else None
+
+def next_due(name, last_completed):
+    """
+    Returns the deadline of a streak: the end of the period after the one it was last completed in.
+
+    Args:
+        name (str): The periodicity name.
+        last_completed (datetime): The date of the last completion.
+
+    Returns:
+        datetime: The first moment at which a completion no longer continues the streak, or None if the
+                  periodicity is unknown.
+    """
+    periodicity = find_periodicity(name)
+    if periodicity is None:
+        return None
+    return periodicity.period_start(periodicity.period_index(last_completed) + 2)
@@ -0,0 +1,307 @@
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from db import get_db, get_streak_counter
+
+class _BatchConnection:
+    """
+    Wraps the write queue's connection while a job runs, so a job cannot end the shared transaction.
+
+    commit() is a no-op because the write queue commits the whole batch, and rollback() only undoes
+    the current job by rolling back to its savepoint.
+    """
+
+    def __init__(self, db):
+        """
+        Initializes a _BatchConnection.
+
+        Args:
+            db (sqlite3.Connection): The write queue's connection.
+        """
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def commit(self):
+        """
+        Does nothing; the batch is committed by the write queue.
+        """
+
+    def rollback(self):
+        """
+        Undoes the changes of the current job only.
+        """
+        self._db.execute("ROLLBACK TO job")
+
+def _store(db, counter):
+    """
+    Stores a new habit.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        counter (Counter): The habit to store.
+
+    Returns:
+        Counter: The stored habit.
+    """
+    counter.store(db)
+    return counter
+
+def _increment(db, name, increment_date):
+    """
+    Completes a habit.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        name (str): The name of the habit.
+        increment_date (str): The completion date (YYYY-MM-DD), or None for now.
+
+    Returns:
+        Counter: The habit after the completion.
+
+    Raises:
+        ValueError: If the habit does not exist.
+    """
+    habit = get_streak_counter(db, name)
+    if habit is None:
+        raise ValueError(f"No habit found with name {name}")
+    habit.increment(db, increment_date)
+    return habit
+
+def _remove(db, name):
+    """
+    Removes a habit.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        name (str): The name of the habit.
+
+    Raises:
+        ValueError: If the habit does not exist.
+    """
+    habit = get_streak_counter(db, name)
+    if habit is None:
+        raise ValueError(f"No habit found with name {name}")
+    habit.remove(db)
+
+class WriteQueue:
+    """
+    Runs all writes to a database on one writer thread, grouping concurrent writes into shared transactions.
+
+    Every job runs inside its own savepoint, so a failing job is undone without affecting the rest of its batch.
+    """
+
+    def __init__(self, name='main.db', profile='balanced', max_batch=100):
+        """
+        Initializes a WriteQueue and starts its writer thread.
+
+        Args:
+            name (str, optional): The name of the database file. Defaults to 'main.db'.
+            profile (str, optional): The performance profile of the writer connection. Defaults to 'balanced'.
+            max_batch (int, optional): The maximum number of jobs committed together. Defaults to 100.
+
+        Raises:
+            ValueError: If the writer cannot connect to the database.
+        """
+        self.name = name
+        self.profile = profile
+        self.max_batch = max_batch
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"WriteQueue({name})", daemon=True)
+        self._thread.start()
+
+        # Wait until the writer has connected, which also migrates the schema before any reader connects
+        self._ready.wait()
+        if self._error:
+            raise ValueError(self._error)
+
+    def submit(self, func, *args):
+        """
+        Queues a write job.
+
+        Args:
+            func (callable): The job, called as func(db, *args) on the writer thread.
+            *args: The arguments to pass after the connection.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the job's return value once its batch is committed.
+        """
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    def store(self, counter):
+        """
+        Queues storing a new habit.
+
+        Args:
+            counter (Counter): The habit to store.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the stored Counter.
+        """
+        return self.submit(_store, counter)
+
+    def increment(self, name, increment_date=None):
+        """
+        Queues completing a habit.
+
+        Args:
+            name (str): The name of the habit.
+            increment_date (str, optional): The completion date (YYYY-MM-DD). Defaults to None (now).
+
+        Returns:
+            concurrent.futures.Future: Resolves to the completed Counter.
+        """
+        return self.submit(_increment, name, increment_date)
+
+    def remove(self, name):
+        """
+        Queues removing a habit.
+
+        Args:
+            name (str): The name of the habit.
+
+        Returns:
+            concurrent.futures.Future: Resolves to None once the habit is removed.
+        """
+        return self.submit(_remove, name)
+
+    def close(self):
+        """
+        Finishes all queued writes and stops the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        """
+        The writer thread: takes all jobs that are waiting, up to max_batch, and runs them in one transaction.
+        """
+        db = get_db(self.name, self.profile)
+        if db is None:
+            self._error = f"Could not connect to {self.name}"
+            self._ready.set()
+            return
+        db.isolation_level = None  # Transactions and savepoints are managed explicitly below
+        self._ready.set()
+
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = [job for job in batch if job is not None]
+            if batch:
+                self._run_batch(db, batch)
+
+        db.close()
+
+    def _run_batch(self, db, batch):
+        """
+        Runs a batch of jobs in one transaction and resolves their futures after the commit.
+
+        Args:
+            db (sqlite3.Connection): The writer connection.
+            batch (list): The (func, args, future) jobs to run.
+        """
+        batch_db = _BatchConnection(db)
+        results = []
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for func, args, future in batch:
+                db.execute("SAVEPOINT job")
+                try:
+                    result = func(batch_db, *args)
+                except Exception as e:
+                    db.execute("ROLLBACK TO job")
+                    db.execute("RELEASE job")
+                    future.set_exception(e)
+                else:
+                    db.execute("RELEASE job")
+                    results.append((future, result))
+            db.execute("COMMIT")
+        except Exception as e:
+            # E.g. another connection held the lock past the busy timeout: fail the batch, keep the writer running
+            if db.in_transaction:
+                try:
+                    db.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            for func, args, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        for future, result in results:
+            future.set_result(result)
+
+class ConnectionPool:
+    """
+    Hands out one connection per thread to the same database file, and owns the file's write queue.
+
+    Reads can use connection() from any number of threads in parallel; writes should go through
+    pool.writes so they never contend for the database lock. The counter cache is per connection
+    and not thread-safe, so leave it disabled when using a pool.
+    """
+
+    def __init__(self, name='main.db', profile='balanced', max_batch=100):
+        """
+        Initializes a ConnectionPool.
+
+        Args:
+            name (str, optional): The name of the database file. Defaults to 'main.db'.
+            profile (str, optional): The performance profile of every connection. Defaults to 'balanced'.
+            max_batch (int, optional): The maximum number of writes committed together. Defaults to 100.
+        """
+        self.name = name
+        self.profile = profile
+        self.writes = WriteQueue(name, profile, max_batch)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """
+        Returns the calling thread's connection, connecting on first use.
+
+        Returns:
+            sqlite3.Connection: The connection of the current thread.
+
+        Raises:
+            ValueError: If the thread cannot connect to the database.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Only this thread uses the connection; other threads may close it in close()
+            db = get_db(self.name, self.profile, check_same_thread=False)
+            if db is None:
+                raise ValueError(f"Could not connect to {self.name}")
+            self._local.db = db
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def close(self):
+        """
+        Finishes all queued writes and closes every connection of the pool.
+        """
+        self.writes.close()
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
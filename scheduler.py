@@ -0,0 +1,34 @@
+from counter import parse_timestamp
+from db import COUNTER_COLUMNS, counter_from_row
+from instrument import instrumented
+
+@instrumented("due_before")
+def due_before(db, timestamp, since=None, limit=None):
+    """
+    Finds the habits whose streak breaks before a moment unless they are completed, soonest first.
+
+    Every habit with a streak stores its deadline in the indexed next_due column, updated by
+    Counter.increment and Counter.reset, so only the habits returned are read.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        timestamp (datetime): Only include deadlines before this moment.
+        since (datetime, optional): Only include deadlines at or after this moment, e.g. now to leave out
+            streaks that are already broken. Defaults to None (all).
+        limit (int, optional): The most habits returned. Defaults to None (all).
+
+    Returns:
+        list: A list of (Counter, deadline) tuples, earliest deadline first.
+    """
+    cur = db.cursor()
+    query = '''SELECT ''' + COUNTER_COLUMNS + ''', next_due FROM tracker WHERE next_due < ?'''
+    params = (timestamp,)
+    if since is not None:
+        query += ''' AND next_due >= ?'''
+        params += (since,)
+    query += ''' ORDER BY next_due'''
+    if limit is not None:
+        query += ''' LIMIT ?'''
+        params += (limit,)
+    cur.execute(query, params)
+    return [(counter_from_row(row[:-1]), parse_timestamp(row[-1])) for row in cur.fetchall()]
@@ -0,0 +1,161 @@
+import argparse
+import glob
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.request import pathname2url
+
+from analyse import get_streak_table
+
+def find_shards(location):
+    """
+    Finds the tracker databases to analyse.
+
+    Args:
+        location (str or list): A directory (all *.db files in it), a glob pattern, or a list of file names.
+
+    Returns:
+        list: The database file names, sorted.
+    """
+    if isinstance(location, (list, tuple)):
+        return sorted(location)
+    if os.path.isdir(location):
+        location = os.path.join(location, '*.db')
+    return sorted(glob.glob(location))
+
+def _open_shard(path):
+    """
+    Opens a tracker database read-only, so the report neither migrates it nor changes its journal mode.
+    """
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+
+def analyse_shard(path, top_k=10):
+    """
+    Reduces one tracker database to a partial leaderboard. Runs in a worker process.
+
+    The database is only read: a shard that cannot be opened or read, e.g. because it is locked, corrupt or
+    has not been upgraded to the current schema by the tracker, is reported with an 'error'.
+
+    Args:
+        path (str): The database file name.
+        top_k (int, optional): The number of longest streaks to keep. Defaults to 10.
+
+    Returns:
+        dict: The shard's 'path', number of 'habits', 'top' (longest streaks), 'shortest' and
+              'by_periodicity' entries as (streak, path, name) tuples, its 'seconds' and any 'error'.
+    """
+    start = time.perf_counter()
+    result = {'path': path, 'habits': 0, 'top': [], 'shortest': None, 'by_periodicity': {}, 'error': None}
+
+    try:
+        db = _open_shard(path)
+        try:
+            rows = get_streak_table(db)
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        result['error'] = str(e)
+    else:
+        entries = [(streak, path, habit.name, habit.periodicity) for habit, streak in rows]
+        result['habits'] = len(entries)
+        result['top'] = [entry[:3] for entry in heapq.nsmallest(top_k, entries, key=_longest_first)]
+        if entries:
+            result['shortest'] = min(entries, key=_shortest_first)[:3]
+        for entry in sorted(entries, key=_longest_first):
+            if entry[0] > 0:  # Like calculate_longest_streak_by_periodicity, a winner needs a streak
+                result['by_periodicity'].setdefault(entry[3], entry[:3])
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def _longest_first(entry):
+    """
+    Sort key putting the longest streak first; ties go to the first shard, then the first name.
+    """
+    return -entry[0], entry[1], entry[2]
+
+def _shortest_first(entry):
+    """
+    Sort key putting the shortest streak first; ties go to the first shard, then the first name.
+    """
+    return entry[0], entry[1], entry[2]
+
+def merge_shards(partials, top_k=10):
+    """
+    Merges the partial results of several shards with top-k, min and max reductions.
+
+    Args:
+        partials (list): The results of analyse_shard.
+        top_k (int, optional): The number of longest streaks to keep. Defaults to 10.
+
+    Returns:
+        dict: The merged 'leaderboard', 'longest', 'shortest' and 'by_periodicity' entries as
+              (streak, path, name) tuples, plus per-shard 'shards' timings.
+    """
+    leaderboard = heapq.nsmallest(top_k, (entry for partial in partials for entry in partial['top']), key=_longest_first)
+    shortest = min((partial['shortest'] for partial in partials if partial['shortest']), key=_shortest_first, default=None)
+
+    by_periodicity = {}
+    for partial in partials:
+        for periodicity, entry in partial['by_periodicity'].items():
+            if periodicity not in by_periodicity or _longest_first(entry) < _longest_first(by_periodicity[periodicity]):
+                by_periodicity[periodicity] = entry
+
+    return {
+        'leaderboard': leaderboard,
+        'longest': leaderboard[0] if leaderboard else None,
+        'shortest': shortest,
+        'by_periodicity': by_periodicity,
+        'shards': [{'path': partial['path'], 'habits': partial['habits'], 'seconds': partial['seconds'],
+                    'error': partial['error']} for partial in partials],
+    }
+
+def analyse_shards(location, top_k=10, processes=None):
+    """
+    Analyses many tracker databases in parallel, one worker process per core by default.
+
+    Args:
+        location (str or list): A directory, a glob pattern, or a list of database file names.
+        top_k (int, optional): The number of longest streaks in the merged leaderboard. Defaults to 10.
+        processes (int, optional): The number of worker processes. Defaults to None (one per core).
+
+    Returns:
+        dict: The merged report, see merge_shards.
+    """
+    paths = find_shards(location)
+    if not paths:
+        return merge_shards([], top_k)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        partials = list(executor.map(analyse_shard, paths, [top_k] * len(paths), chunksize=max(1, len(paths) // 64)))
+    return merge_shards(partials, top_k)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Longest and shortest streaks across many tracker databases.")
+    parser.add_argument('location', help="a directory of .db files or a glob pattern")
+    parser.add_argument('--top', type=int, default=10, help="the number of longest streaks to show")
+    parser.add_argument('--processes', type=int, default=None, help="the number of worker processes")
+    parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = analyse_shards(args.location, args.top, args.processes)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        sys.exit(0)
+
+    print(f"Longest streaks across {len(report['shards'])} databases:")
+    for streak, path, name in report['leaderboard']:
+        print(f"{streak:>6}  {name} ({path})")
+    if report['shortest']:
+        streak, path, name = report['shortest']
+        print(f"The shortest streak is {name} ({path}) with a streak of {streak}")
+    for periodicity, (streak, path, name) in sorted(report['by_periodicity'].items()):
+        print(f"The longest streak for {periodicity} habits is {name} ({path}) with a streak of {streak}")
+    for shard in report['shards']:
+        status = f"error: {shard['error']}" if shard['error'] else f"{shard['habits']} habits"
+        print(f"  {shard['path']}: {status} in {shard['seconds'] * 1000:.1f} ms")
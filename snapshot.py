@@ -0,0 +1,266 @@
+import mmap
+import sqlite3
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from counter import parse_timestamp
+from db import get_schema_version
+from events import logger
+
+# Identifies snapshot files and the version of their layout
+MAGIC = b"HTSNAP\0\1"
+FORMAT_VERSION = 3
+# Magic, format version, byte order, schema version, string count, string bytes and the row count of every table
+HEADER = struct.Struct("<8sHHIqqqqqq")
+# Stands for NULL in the integer columns
+NULL = -2 ** 63
+
+# The tables in a snapshot and their columns, in file order
+TABLES = (
+    ('tracker', ('id', 'name', 'description', 'periodicity', 'creation_date', 'last_completed', 'current_streak',
+                 'longest_streak', 'streak_start', 'streak_epoch', 'compacted_epoch', 'next_due'), 'id'),
+    ('counter', ('habit_id', 'increment_date', 'period_index', 'epoch'), 'id'),
+    ('streak_archive', ('habit_id', 'epoch', 'first_completed', 'last_completed', 'first_period', 'last_period',
+                        'completions'), 'habit_id, epoch'),
+    ('completion_rollup', ('day', 'habit_id', 'completions'), 'day, habit_id'),
+)
+# Columns stored as indexes into the string table
+STRING_COLUMNS = {'name', 'description', 'periodicity'}
+# Columns stored as microseconds since 0001-01-01
+DATE_COLUMNS = {'creation_date', 'last_completed', 'streak_start', 'increment_date', 'first_completed', 'next_due'}
+
+def _encode_date(value):
+    """
+    Converts a stored timestamp to microseconds since 0001-01-01.
+    """
+    date = parse_timestamp(value)
+    seconds = date.toordinal() * 86400 + date.hour * 3600 + date.minute * 60 + date.second
+    return seconds * 1_000_000 + date.microsecond
+
+def _decode_date(value):
+    """
+    Converts microseconds since 0001-01-01 back to the timestamp format the tracker stores.
+    """
+    seconds, microseconds = divmod(value, 1_000_000)
+    days, seconds = divmod(seconds, 86400)
+    return str(datetime.fromordinal(days) + timedelta(seconds=seconds, microseconds=microseconds))
+
+def export_snapshot(db, path):
+    """
+    Writes the habits, completions, archived streaks and daily rollups of a database to a snapshot file.
+
+    Every column is stored as an array of 64-bit integers; names, descriptions and periodicities are
+    stored once in a string table, and dates as microseconds.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        path (str): The snapshot file name.
+
+    Returns:
+        dict: The number of rows written per table.
+    """
+    strings = {}  # String -> index in the string table
+    dates = {}  # Stored timestamp -> encoded date; completions share few distinct dates
+    sections = []
+    counts = {}
+
+    cur = db.cursor()
+    for table, columns, order in TABLES:
+        arrays = [array('q') for _ in columns]
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}")
+        for row in cur:
+            for column, values, value in zip(columns, arrays, row):
+                if value is None:
+                    values.append(NULL)
+                elif column in STRING_COLUMNS:
+                    values.append(strings.setdefault(value, len(strings)))
+                elif column in DATE_COLUMNS:
+                    encoded = dates.get(value)
+                    if encoded is None:
+                        encoded = dates[value] = _encode_date(value)
+                    values.append(encoded)
+                else:
+                    values.append(value)
+        counts[table] = len(arrays[0])
+        sections += arrays
+
+    # The string table: the end offset of every string, then the UTF-8 bytes, padded to keep the columns aligned
+    blob = bytearray()
+    offsets = array('q')
+    for text in strings:
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+    blob += bytes(-len(blob) % 8)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, sys.byteorder == 'little', get_schema_version(db),
+                            len(strings), len(blob), *counts.values()))
+        f.write(offsets.tobytes())
+        f.write(blob)
+        for values in sections:
+            f.write(values.tobytes())
+
+    logger.info("Exported %d habits and %d completions to %s.", counts['tracker'], counts['counter'], path)
+    return counts
+
+class Snapshot:
+    """
+    A memory-mapped snapshot file whose columns are read in place, without copying.
+
+    Each column is a memoryview of 64-bit integers over the mapped file; close() releases them.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a snapshot file.
+
+        Args:
+            path (str): The snapshot file name.
+
+        Raises:
+            ValueError: If the file is not a snapshot or uses an unknown format version.
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        self._buffer = memoryview(self._map)
+
+        try:
+            if len(self._buffer) < HEADER.size:
+                raise ValueError(f"{path} is not a habit tracker snapshot.")
+            magic, version, little_endian, self.schema_version, n_strings, blob_size, *counts = \
+                HEADER.unpack_from(self._buffer)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a habit tracker snapshot.")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} uses snapshot format {version}, expected {FORMAT_VERSION}.")
+            self._swap = bool(little_endian) != (sys.byteorder == 'little')
+
+            offset = HEADER.size
+            self._offsets, offset = self._column(offset, n_strings)
+            self._blob = self._buffer[offset:offset + blob_size]
+            self._views.append(self._blob)
+            offset += blob_size
+
+            # Columns by table, e.g. self.tables['counter']['habit_id']
+            self.tables = {}
+            for (table, columns, order), count in zip(TABLES, counts):
+                self.tables[table] = {}
+                for column in columns:
+                    self.tables[table][column], offset = self._column(offset, count)
+            if offset != len(self._buffer):
+                raise ValueError(f"{path} is truncated or corrupt.")
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _column(self, offset, count):
+        """
+        Returns a view of count 64-bit integers at offset and the offset after them.
+        """
+        end = offset + count * 8
+        if end > len(self._buffer):
+            raise ValueError("The snapshot is truncated or corrupt.")
+        view = self._buffer[offset:end]
+        self._views.append(view)
+        if self._swap:  # Written on a machine with the other byte order, so the column has to be copied
+            values = array('q')
+            values.frombytes(view)
+            values.byteswap()
+            view = memoryview(values)
+        view = view.cast('q')
+        self._views.append(view)
+        return view, end
+
+    def string(self, index):
+        """
+        Returns an entry of the string table.
+
+        Args:
+            index (int): The index stored in a string column.
+
+        Returns:
+            str: The string, or None for NULL.
+        """
+        if index == NULL:
+            return None
+        start = self._offsets[index - 1] if index else 0
+        return str(self._blob[start:self._offsets[index]], 'utf-8')
+
+    def rows(self, table):
+        """
+        Decodes the rows of a table, with strings and dates in the form the database stores.
+
+        Args:
+            table (str): The table name.
+
+        Yields:
+            tuple: The values of each row, in the column order of TABLES.
+        """
+        columns = self.tables[table]
+        strings = {}
+        dates = {}
+        decoders = []
+        for column in columns:
+            if column in STRING_COLUMNS:
+                decoders.append(lambda value: strings[value] if value in strings else strings.setdefault(value, self.string(value)))
+            elif column in DATE_COLUMNS:
+                decoders.append(lambda value: dates[value] if value in dates else dates.setdefault(value, _decode_date(value)))
+            else:
+                decoders.append(None)
+
+        for row in zip(*columns.values()):
+            yield tuple(None if value == NULL else decode(value) if decode else value
+                        for decode, value in zip(decoders, row))
+
+    def close(self):
+        """
+        Releases the column views and unmaps the file.
+        """
+        for view in reversed(self._views):  # Views derived from another view are released first
+            view.release()
+        self._views = []
+        self._buffer.release()
+        self._map.close()
+
+def restore_snapshot(db, path):
+    """
+    Loads a snapshot into an empty database in a single transaction.
+
+    Args:
+        db (sqlite3.Connection): The database connection object.
+        path (str): The snapshot file name.
+
+    Returns:
+        dict: The number of rows loaded per table, or None if the restore failed.
+
+    Raises:
+        ValueError: If the database already contains habits, or the file is not a snapshot.
+    """
+    if db.execute("SELECT 1 FROM tracker LIMIT 1").fetchone():
+        raise ValueError("Snapshots can only be restored into an empty database.")
+
+    counts = {}
+    with Snapshot(path) as snapshot:
+        cur = db.cursor()
+        try:
+            for table, columns, order in TABLES:
+                cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                snapshot.rows(table))
+                counts[table] = len(snapshot.tables[table][columns[0]])
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            logger.error("An error occurred while restoring the snapshot: %s", e)
+            return None
+
+    logger.info("Restored %d habits and %d completions from %s.", counts['tracker'], counts['counter'], path)
+    return counts
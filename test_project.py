@@ -1,7 +1,72 @@
+import asyncio
+import io
+import json
+import logging.handlers
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+from datetime import datetime
+
 import pytest
-from analyse import calculate_longest_streak, calculate_shortest_streak
-from counter import Counter
-from db import get_streak_counter, get_db
+from benchmark import find_regressions
+from async_tracker import AsyncTracker
+from analyse import calculate_longest_streak, calculate_shortest_streak, calculate_all_streaks, calculate_longest_streak_by_periodicity, streak_report, calculate_completion_statistics, calculate_rolling_completion_rates, get_completions_between, calculate_slipped_habits
+from cache import counter_cache, habit_index
+from counter import Counter, import_completions
+from db import get_counter_by_id, get_counters, get_habit_ids, get_streak_counter, get_db, get_schema_version, migrate, SCHEMA_VERSION, get_habits, get_db_settings, apply_profile, get_habit_page, get_periodicities, iter_habits
+import events
+from compaction import compact
+from example_data import generate_data
+from history import build_checkpoints, calculate_longest_streak_as_of, count_as_of, streak_as_of, streak_leaderboard_as_of
+from instrument import instrumentation
+from main import main
+from periodicity import Periodicity, get_periodicity, next_due
+from pool import ConnectionPool
+from shards import analyse_shards
+from scheduler import due_before
+from snapshot import Snapshot, export_snapshot, restore_snapshot
+
+# The longest acceptable import time of main.py, which runs before the first prompt
+STARTUP_BUDGET_MS = 150
+# The random seeds the equivalence tests run with; raise HABIT_TRACKER_TEST_SEEDS for a longer search
+SEEDS = range(int(os.environ.get("HABIT_TRACKER_TEST_SEEDS", 5)))
+# The number of completions the load test writes concurrently
+LOAD_OPERATIONS = int(os.environ.get("HABIT_TRACKER_LOAD_OPERATIONS", 2000))
+# The gaps in days between random completions, per periodicity: repeats, continuations and breaks
+GAPS = {"daily": (0, 1, 1, 1, 2, 5), "weekly": (0, 3, 7, 7, 10, 20), "monthly": (0, 15, 30, 31, 45, 70)}
+
+
+def random_completions(rng, periodicity, count):
+    """
+    Generates completion dates, oldest first, that repeat, continue and break streaks of a periodicity.
+    """
+    dates = []
+    day = datetime(2024, 1, 1).toordinal()
+    for _ in range(count):
+        day += rng.choice(GAPS[periodicity])
+        dates.append(datetime.fromordinal(day).replace(hour=rng.randrange(24), minute=rng.randrange(60)))
+    return sorted(dates)
+
+
+def reference_streaks(periodicity, dates):
+    """
+    Replays completions one at a time with the rule of Counter.is_streak_valid.
+
+    Returns:
+        tuple: The (current streak, longest streak) after the last completion.
+    """
+    engine = get_periodicity(periodicity)
+    current_streak = longest_streak = 0
+    last_period = None
+    for date in dates:
+        period = engine.period_index(date)
+        current_streak = current_streak + 1 if current_streak and engine.continues(last_period, period) else 1
+        last_period = period
+        longest_streak = max(longest_streak, current_streak)
+    return current_streak, longest_streak
 
 
 class TestHabitTracker:
@@ -12,19 +77,13 @@ class TestHabitTracker:
         Set up the test environment before each test method.
 
         This method:
-        1. Connects to a test database
-        2. Clears existing data from the counter and tracker tables
-        3. Creates and stores two test habits
+        1. Connects to a new in-memory test database, so tests never share state
+        2. Creates and stores two test habits
         """
-        self.db = get_db('test.db')
+        self.db = get_db(':memory:')
         if self.db is None:
             raise ValueError("Failed to establish database connection")
 
-        cur = self.db.cursor()
-        cur.execute("DELETE FROM counter")
-        cur.execute("DELETE FROM tracker")
-        self.db.commit()
-
         self.habit1 = Counter("test_habit_1", "test_desc_1", "daily")
         self.habit2 = Counter("test_habit_2", "test_desc_2", "weekly")
 
@@ -75,6 +134,833 @@ class TestHabitTracker:
         assert worst_streak.name == "test_habit_2", "Worst streak should be test_habit_2"
         assert worst_streak.count(self.db) == 1, "Worst streak count should be 1"
 
+    def test_streak_report(self):
+        """
+        Test that the single-query streak report agrees with the per-habit counts.
+        """
+        for date in ["2025-02-03", "2025-02-04"]:
+            self.habit1.increment(self.db, date)
+        self.habit2.increment(self.db, "2025-01-30")
+
+        report = streak_report(self.db)
+        assert [(habit.name, streak) for habit, streak in report['leaderboard']] == [("test_habit_1", 2), ("test_habit_2", 1)]
+        assert report['longest'].name == "test_habit_1"
+        assert report['shortest'].name == "test_habit_2"
+        assert report['by_periodicity']['weekly'].name == "test_habit_2"
+
+        assert calculate_all_streaks(self.db) == {"test_habit_1": 2, "test_habit_2": 1}
+        assert calculate_longest_streak_by_periodicity(self.db, "daily").name == "test_habit_1"
+        assert calculate_longest_streak_by_periodicity(self.db, "monthly") is None
+
+    def test_increment_many_matches_increment(self):
+        """
+        Test that a batch of completions leaves the same state as incrementing one date at a time.
+        """
+        dates = ["2025-02-04", "2025-01-30", "2025-02-03", "2025-02-01", "2025-02-05"]
+        for date in sorted(dates):
+            self.habit1.increment(self.db, date)
+
+        batched = Counter("test_habit_3", "test_desc_3", "daily")
+        batched.store(self.db)
+        assert batched.increment_many(self.db, dates) == 5
+
+        assert batched.count(self.db) == self.habit1.count(self.db) == 3
+        assert batched.last_completed == self.habit1.last_completed
+        stored = self.db.execute("SELECT last_completed FROM tracker WHERE name = 'test_habit_3'").fetchone()[0]
+        assert stored == "2025-02-05 00:00:00"
+
+    def test_import_completions(self):
+        """
+        Test recording completions for several habits in one call.
+        """
+        total = import_completions(self.db, [(self.habit1, ["2025-02-03", "2025-02-04"]),
+                                             (self.habit2, ["2025-01-01", "2025-01-06", "2025-01-30"])])
+        assert total == 5
+        assert self.habit1.count(self.db) == 2
+        assert self.habit2.count(self.db) == 1  # The weekly streak breaks before 2025-01-30
+
+    def test_streak_state_keeps_history(self):
+        """
+        Test that streak breaks and resets update the stored streak state without deleting completions.
+        """
+        for date in ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-10", "2025-01-11"]:
+            self.habit1.increment(self.db, date)
+
+        habit = get_streak_counter(self.db, "test_habit_1")
+        assert (habit.current_streak, habit.longest_streak) == (2, 3)
+        assert habit.streak_start == datetime(2025, 1, 10)
+
+        habit.reset(self.db)
+        assert habit.count(self.db) == 0
+        assert get_streak_counter(self.db, "test_habit_1").longest_streak == 3
+        assert self.db.execute("SELECT COUNT(*) FROM counter WHERE habit_id = ?", (habit.id,)).fetchone()[0] == 5
+
+    def test_counter_cache(self):
+        """
+        Test that the counter cache serves repeated lookups and is invalidated by writes.
+        """
+        counter_cache.enable(maxsize=1)
+        try:
+            first = get_streak_counter(self.db, "test_habit_1")
+            assert get_streak_counter(self.db, "test_habit_1") is first
+            assert (counter_cache.hits, counter_cache.misses) == (1, 1)
+
+            first.increment(self.db, "2025-02-03")
+            reloaded = get_streak_counter(self.db, "test_habit_1")
+            assert reloaded is not first and reloaded.count(self.db) == 1
+
+            get_streak_counter(self.db, "test_habit_2")  # Evicts test_habit_1
+            assert counter_cache.stats()['size'] == 1
+            assert get_streak_counter(self.db, "test_habit_1") is not reloaded
+        finally:
+            counter_cache.disable()
+
+    def test_loaded_counter_parses_dates(self):
+        """
+        Test that a habit loaded from the database compares dates as datetimes and keeps its creation date.
+        """
+        self.habit1.increment(self.db, "2025-02-03")
+
+        habit = get_streak_counter(self.db, "test_habit_1")
+        assert habit.last_completed == datetime(2025, 2, 3)
+        assert habit.creation_date == self.habit1.creation_date
+        assert not hasattr(habit, "__dict__")
+
+        habit.increment(self.db, "2025-02-04")  # Continues the streak loaded from the database
+        assert habit.count(self.db) == 2
+
+    def test_completion_statistics(self):
+        """
+        Test the vectorized full-history statistics against the stored streak state.
+        """
+        pytest.importorskip("numpy")
+        self.habit1.increment_many(self.db, ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-06", "2025-01-07"])
+        self.habit2.increment_many(self.db, ["2025-01-01", "2025-01-20"])
+        Counter("test_habit_3", "test_desc_3", "monthly").store(self.db)
+
+        stats = calculate_completion_statistics(self.db, now=datetime(2025, 1, 10))
+        assert stats["test_habit_1"] == {'completions': 5, 'longest_streak': 3, 'completion_rate': 0.5,
+                                         'mean_gap_days': 1.5, 'max_gap_days': 3.0}
+        assert stats["test_habit_1"]['longest_streak'] == get_streak_counter(self.db, "test_habit_1").longest_streak
+        assert stats["test_habit_2"]['longest_streak'] == 1
+        assert stats["test_habit_2"]['max_gap_days'] == 19.0
+        assert stats["test_habit_3"]['completions'] == 0
+
+    def test_generate_data(self):
+        """
+        Test that the synthetic data generator is reproducible.
+        """
+        names = generate_data(self.db, 6, 60, end_date=datetime(2025, 1, 1), seed=1)
+        streaks = calculate_all_streaks(self.db)
+        assert set(names) <= set(get_habits(self.db))
+
+        other = get_db(':memory:')
+        generate_data(other, 6, 60, end_date=datetime(2025, 1, 1), seed=1)
+        assert {name: calculate_all_streaks(other)[name] for name in names} == {name: streaks[name] for name in names}
+        other.close()
+
+    def test_find_regressions(self):
+        """
+        Test that only meaningful slowdowns of tracked metrics are reported.
+        """
+        baseline = {'Counter.count[10x30]': 1.0, 'Counter.increment[10x30]': 0.01, 'db.get_habits[10x30]': 1.0}
+        results = {'Counter.count[10x30]': 1.5, 'Counter.increment[10x30]': 0.03, 'db.get_habits[10x30]': 1.1,
+                   'analyse.calculate_all_streaks[10x30]': 9.0}
+        assert find_regressions(baseline, results) == [('Counter.count[10x30]', 1.0, 1.5)]
+
+    def test_database_profiles(self, tmp_path):
+        """
+        Test that performance profiles are applied and reported per connection.
+        """
+        path = str(tmp_path / "profile.db")
+        bulk = get_db(path, profile='bulk')
+        durable = get_db(path)
+
+        assert get_db_settings(bulk)['journal_mode'] == 'wal'
+        assert get_db_settings(bulk)['synchronous'] == 0
+        assert get_db_settings(durable)['synchronous'] == 2
+
+        apply_profile(bulk, 'balanced')
+        assert get_db_settings(bulk)['synchronous'] == 1
+        with pytest.raises(ValueError):
+            get_db(path, profile='fast')
+        bulk.close()
+        durable.close()
+
+    def test_connection_pool_concurrent_writes(self, tmp_path):
+        """
+        Test that many threads can complete habits and read streaks at the same time through a pool.
+        """
+        pool = ConnectionPool(str(tmp_path / "pool.db"), max_batch=50)
+        names = [f"pool_habit_{i}" for i in range(4)]
+        for future in [pool.writes.store(Counter(name, "desc", "daily")) for name in names]:
+            future.result()
+
+        dates = [f"2025-01-{day:02d}" for day in range(1, 21)]
+        errors = []
+
+        def worker(name):
+            try:
+                futures = [pool.writes.increment(name, date) for date in dates]
+                get_streak_counter(pool.connection(), name).count(pool.connection())  # Reads run alongside the writes
+                for future in futures:
+                    future.result()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        with pytest.raises(ValueError):
+            pool.writes.increment("missing_habit").result()
+        db = pool.connection()
+        assert {name: get_streak_counter(db, name).count(db) for name in names} == {name: 20 for name in names}
+        assert pool.writes.batches < 4 + len(names) * len(dates)  # Concurrent writes shared transactions
+        pool.close()
+
+    def test_write_queue_survives_locked_database(self, tmp_path, monkeypatch):
+        """
+        Test that a batch failing on a locked database fails its futures without stopping the writer.
+        """
+        path = str(tmp_path / "locked.db")
+        pool = ConnectionPool(path)
+        pool.writes.store(Counter("locked_habit", "desc", "daily")).result()
+        pool.writes.submit(lambda db: db.execute("PRAGMA busy_timeout = 50")).result()  # Fail fast when locked
+
+        other = sqlite3.connect(path)
+        other.execute("BEGIN IMMEDIATE")  # Holds the write lock
+        with pytest.raises(sqlite3.OperationalError):
+            pool.writes.increment("locked_habit", "2025-01-01").result(timeout=10)
+        other.rollback()
+        other.close()
+
+        assert pool.writes.increment("locked_habit", "2025-01-02").result(timeout=10).count(pool.connection()) == 1
+        assert pool.writes._thread.is_alive()
+
+        monkeypatch.setattr("pool.get_db", lambda *args, **kwargs: None)
+        errors = []
+        thread = threading.Thread(target=lambda: errors.append(pytest.raises(ValueError, pool.connection)))
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        pool.close()
+
+    def test_async_tracker(self, tmp_path):
+        """
+        Test that the async front-end runs writes, lookups and analyses concurrently from one event loop.
+        """
+        async def scenario():
+            async with AsyncTracker(str(tmp_path / "async.db"), max_pending=2) as tracker:
+                await asyncio.gather(tracker.store(Counter("async_1", "desc", "daily")),
+                                     tracker.store(Counter("async_2", "desc", "weekly")))
+                await asyncio.gather(*[tracker.increment("async_1", f"2025-01-{day:02d}") for day in range(1, 6)],
+                                     tracker.increment("async_2", "2025-01-01"))
+                habits, longest, habit = await asyncio.gather(tracker.get_habits(),
+                                                              tracker.calculate_longest_streak(),
+                                                              tracker.get_streak_counter("async_2"))
+                return habits, longest.name, habit.current_streak
+
+        assert asyncio.run(scenario()) == (["async_1", "async_2"], "async_1", 1)
+
+    def test_paginated_habit_listing(self):
+        """
+        Test keyset pagination with prefix, search and periodicity filters.
+        """
+        for name in ["apple", "apricot", "banana", "blueberry", "cherry_pie"]:
+            Counter(name, "desc", "weekly" if name.startswith("b") else "daily").store(self.db)
+
+        assert get_habit_page(self.db, page_size=2) == ["apple", "apricot"]
+        assert get_habit_page(self.db, after="apricot", page_size=2) == ["banana", "blueberry"]
+        assert list(iter_habits(self.db, page_size=2)) == get_habits(self.db) == sorted(get_habits(self.db))
+        assert list(iter_habits(self.db, prefix="ap", page_size=1)) == ["apple", "apricot"]
+        assert list(iter_habits(self.db, search="RR")) == ["blueberry", "cherry_pie"]
+        assert list(iter_habits(self.db, search="_")) == ["cherry_pie", "test_habit_1", "test_habit_2"]
+        assert list(iter_habits(self.db, periodicity="weekly", page_size=1)) == ["banana", "blueberry", "test_habit_2"]
+
+    def test_analyse_shards(self, tmp_path):
+        """
+        Test that leaderboards of several databases are merged across worker processes.
+        """
+        streaks = {"user_a": {"read": 3, "run": 1}, "user_b": {"read": 5, "swim": 0}, "user_c": {"walk": 2}}
+        for user, habits in streaks.items():
+            db = get_db(str(tmp_path / f"{user}.db"))
+            for name, streak in habits.items():
+                habit = Counter(name, "desc", "weekly" if name == "swim" else "daily")
+                habit.store(db)
+                habit.increment_many(db, [f"2025-01-{day:02d}" for day in range(1, streak + 1)])
+            db.close()
+        (tmp_path / "broken.db").write_text("not a database")
+        old = sqlite3.connect(str(tmp_path / "old.db"))  # Not upgraded by the tracker yet
+        old.execute("CREATE TABLE tracker (id INTEGER PRIMARY KEY, name TEXT UNIQUE, description TEXT, periodicity TEXT)")
+        old.close()
+
+        report = analyse_shards(str(tmp_path), top_k=3, processes=2)
+        assert [(streak, name) for streak, path, name in report['leaderboard']] == [(5, "read"), (3, "read"), (2, "walk")]
+        assert report['longest'][1].endswith("user_b.db")
+        assert report['shortest'][0] == 0 and report['shortest'][2] == "swim"
+        assert set(report['by_periodicity']) == {"daily"}
+        assert [shard['error'] is not None for shard in report['shards']] == [True, True, False, False, False]
+
+        # The report only reads: the old shard is neither migrated nor switched to WAL
+        old = sqlite3.connect(str(tmp_path / "old.db"))
+        assert old.execute("PRAGMA user_version").fetchone()[0] == 0
+        assert old.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        old.close()
+
+    def test_select_habit_pages(self, monkeypatch):
+        """
+        Test that the habit picker only offers another page when there is one.
+        """
+        import questionary
+        import main as main_module
+        offered = []
+        answers = None
+
+        class Prompt:
+            def __init__(self, message, choices):
+                offered.append([choice if isinstance(choice, str) else choice.title for choice in choices])
+
+            def ask(self):
+                return next(answers)
+
+        monkeypatch.setattr(questionary, "select", Prompt)
+        monkeypatch.setattr(main_module, "PAGE_SIZE", 2)
+        # Exactly one full page: no "More habits..." entry
+        answers = iter(["test_habit_1"])
+        assert main_module.select_habit(self.db, "Pick") == "test_habit_1"
+        assert offered == [["test_habit_1", "test_habit_2", "Search..."]]
+
+        Counter("test_habit_3", "desc", "daily").store(self.db)
+        offered.clear()
+        answers = iter([main_module.MORE_HABITS, "test_habit_3"])
+        assert main_module.select_habit(self.db, "Pick") == "test_habit_3"
+        assert offered == [["test_habit_1", "test_habit_2", "More habits...", "Search..."], ["test_habit_3", "Search..."]]
+
+    def test_calendar_periodicities(self):
+        """
+        Test that streaks follow calendar periods rather than fixed day counts.
+        """
+        monthly = Counter("test_monthly", "desc", "monthly")
+        monthly.store(self.db)
+        monthly.increment_many(self.db, ["2025-01-01", "2025-02-28", "2025-03-31"])  # Consecutive months, 58 and 31 days apart
+        assert monthly.count(self.db) == 3
+
+        # 2025-01-05 is a Sunday and 2025-01-13 the Monday a week after the next one
+        self.habit2.increment_many(self.db, ["2025-01-05", "2025-01-06", "2025-01-13"])
+        assert self.habit2.count(self.db) == 3
+        self.habit2.increment(self.db, "2025-01-27")
+        assert self.habit2.count(self.db) == 1
+
+        every_3_days = Counter("test_every_3_days", "desc", "every 3 days")
+        every_3_days.store(self.db)
+        every_3_days.increment_many(self.db, ["2025-01-01", "2025-01-04", "2025-01-12"])
+        assert every_3_days.count(self.db) == 1
+        assert get_periodicity("every 3 days").days == 3
+        with pytest.raises(ValueError):
+            get_periodicity("fortnightly")
+
+        stored = self.db.execute("SELECT period_index FROM counter WHERE habit_id = ? ORDER BY id", (monthly.id,)).fetchall()
+        assert stored == [(2025 * 12,), (2025 * 12 + 1,), (2025 * 12 + 2,)]
+        assert get_periodicities(self.db) == ["daily", "every 3 days", "monthly", "weekly"]
+
+        # A periodicity must map dates to periods both ways
+        class NoStart(Periodicity):
+            def period_index(self, value):
+                return value.toordinal()
+        with pytest.raises(TypeError):
+            NoStart()
+
+    def test_compaction_archives_old_epochs(self):
+        """
+        Test that compaction summarizes finished streaks and keeps the current one in the log.
+        """
+        self.habit1.increment_many(self.db, ["2025-01-01", "2025-01-02", "2025-01-05", "2025-01-08", "2025-01-09"])
+        assert self.habit1.streak_epoch == 3
+        current = self.db.execute("SELECT COUNT(*) FROM counter WHERE habit_id = ? AND epoch = ?",
+                                  (self.habit1.id, self.habit1.streak_epoch)).fetchone()[0]
+        assert current == self.habit1.count(self.db) == 2
+
+        result = compact(self.db)
+        assert (result['archived_epochs'], result['deleted_completions'], result['finished']) == (2, 3, True)
+        archive = self.db.execute("SELECT epoch, first_completed, last_completed, completions FROM streak_archive ORDER BY epoch").fetchall()
+        assert archive == [(1, "2025-01-01 00:00:00", "2025-01-02 00:00:00", 2), (2, "2025-01-05 00:00:00", "2025-01-05 00:00:00", 1)]
+        assert self.db.execute("SELECT COUNT(*) FROM counter WHERE habit_id = ?", (self.habit1.id,)).fetchone()[0] == 2
+
+        self.habit1.increment(self.db, "2025-01-20")
+        assert compact(self.db)['archived_epochs'] == 1
+        assert compact(self.db)['archived_epochs'] == 0
+        habit = get_streak_counter(self.db, "test_habit_1")
+        assert (habit.count(self.db), habit.longest_streak) == (1, 2)
+
+    def test_instrumentation(self, tmp_path):
+        """
+        Test that instrumented operations record latency and nested query counts, and can be dumped.
+        """
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            self.habit1.increment(self.db, "2025-01-30")
+            calculate_longest_streak(self.db)
+        finally:
+            instrumentation.disable()
+
+        data = instrumentation.snapshot()
+        assert data['Counter.increment']['calls'] == 1
+        assert data['Counter.increment']['queries'] >= 2  # The insert and the streak update
+        assert sum(data['Counter.increment']['histogram'].values()) == 1
+        # calculate_longest_streak counts the queries of the streak_report and get_streak_table calls it makes
+        assert data['calculate_longest_streak']['queries'] >= data['get_streak_table']['queries'] >= 1
+
+        instrumentation.dump(str(tmp_path / "profile.prom"))
+        text = (tmp_path / "profile.prom").read_text()
+        assert 'habit_tracker_operation_seconds_count{operation="Counter.increment"} 1' in text
+        assert 'habit_tracker_operation_seconds_bucket{operation="Counter.increment",le="+Inf"} 1' in text
+        instrumentation.reset()
+
+    def test_fast_startup(self, tmp_path):
+        """
+        Test that importing the CLI stays within its startup budget and defers the heavy modules.
+        """
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        # Each line reads "import time: self [us] | cumulative [us] | module"
+        imports = {line.split("|")[2].strip(): int(line.split("|")[1]) for line in result.stderr.splitlines()[1:]}
+        assert not {"questionary", "prompt_toolkit", "analyse", "numpy", "logging.handlers"} & set(imports)
+        assert imports["main"] < STARTUP_BUDGET_MS * 1000
+
+        # Opening an up-to-date database only reads the schema version, without any DDL
+        get_db(str(tmp_path / "startup.db")).close()
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            get_db(str(tmp_path / "startup.db")).close()
+        finally:
+            instrumentation.disable()
+        assert instrumentation.snapshot()['migrate']['queries'] == 1
+        instrumentation.reset()
+
+    def test_batch_commands(self, tmp_path, monkeypatch, capsys):
+        """
+        Test the non-interactive complete, import and report commands.
+        """
+        path = str(tmp_path / "batch.db")
+        db = get_db(path)  # The commands open their own connection, so they need a database file
+        Counter("test_habit_1", "test_desc_1", "daily").store(db)
+        Counter("test_habit_2", "test_desc_2", "weekly").store(db)
+
+        csv_file = tmp_path / "completions.csv"
+        csv_file.write_text("habit,date\ntest_habit_1,2025-01-30\ntest_habit_2,2025-01-30\ntest_habit_1,2025-01-31\n")
+        assert main(["--db", path, "import", str(csv_file)]) == 0
+
+        monkeypatch.setattr(sys, "stdin", io.StringIO("test_habit_1,2025-02-01\nunknown_habit\n"))
+        assert main(["--db", path, "complete", "-", "test_habit_2", "--date", "2025-02-03"]) == 1  # Unknown habit
+        assert get_streak_counter(db, "test_habit_1").count(db) == 3
+        assert get_streak_counter(db, "test_habit_2").count(db) == 2
+
+        capsys.readouterr()
+        assert main(["--db", path, "report", "--json"]) == 0
+        report = json.loads(capsys.readouterr().out)
+        assert [(habit['name'], habit['current_streak']) for habit in report['habits']] == [("test_habit_1", 3), ("test_habit_2", 2)]
+        assert report['by_periodicity'] == {"daily": "test_habit_1", "weekly": "test_habit_2"}
+
+        # A bad date rolls back the whole invocation
+        monkeypatch.setattr(sys, "stdin", io.StringIO("test_habit_1,2025-02-02\ntest_habit_1,not a date\n"))
+        assert main(["--db", path, "import", "-"]) == 1
+        assert get_streak_counter(db, "test_habit_1").count(db) == 3
+
+        # A missing file is an error, not a traceback
+        assert main(["--quiet", "--db", path, "import", str(tmp_path / "missing.csv")]) == 1
+        db.close()
+
+        # Without a command the interactive CLI opens the --db file too
+        opened = []
+        monkeypatch.setattr("main.cli", opened.append)
+        assert main(["--db", path]) == 0
+        assert opened == [path]
+
+    def test_snapshot_round_trip(self, tmp_path):
+        """
+        Test that a snapshot restores every habit, completion and archived streak unchanged.
+        """
+        self.habit1.increment_many(self.db, ["2025-01-01", "2025-01-02", "2025-01-05", datetime(2025, 1, 6, 7, 30, 0, 250)])
+        self.habit2.increment(self.db, "2025-01-30")
+        compact(self.db)
+
+        path = str(tmp_path / "backup.snap")
+        assert export_snapshot(self.db, path) == {'tracker': 2, 'counter': 3, 'streak_archive': 1, 'completion_rollup': 5}
+        with Snapshot(path) as snapshot:
+            assert snapshot.tables['counter']['habit_id'].tolist() == [self.habit1.id, self.habit1.id, self.habit2.id]
+            assert snapshot.string(snapshot.tables['tracker']['name'][1]) == "test_habit_2"
+
+        restored = get_db(str(tmp_path / "restored.db"))
+        assert restore_snapshot(restored, path)['counter'] == 3
+        for query in ["SELECT * FROM tracker ORDER BY id",
+                      "SELECT habit_id, increment_date, period_index, epoch FROM counter ORDER BY id",
+                      "SELECT * FROM streak_archive", "SELECT * FROM completion_rollup"]:
+            assert restored.execute(query).fetchall() == self.db.execute(query).fetchall()
+
+        with pytest.raises(ValueError):
+            restore_snapshot(restored, path)  # Only into an empty database
+        restored.close()
+        with pytest.raises(ValueError):
+            Snapshot(str(tmp_path / "restored.db"))
+
+        # The restore command reports these failures with exit status 1
+        restored_path = str(tmp_path / "restored.db")
+        assert main(["--quiet", "--db", restored_path, "restore", path]) == 1
+        assert main(["--quiet", "--db", restored_path, "restore", str(tmp_path / "missing.snap")]) == 1
+        assert main(["--quiet", "--db", restored_path, "export", str(tmp_path / "missing" / "backup.snap")]) == 1
+
+    def test_rollup_analytics(self):
+        """
+        Test rolling-window rates, date-range counts and slipped habits computed from the daily rollups.
+        """
+        daily = Counter("rollup_daily", "desc", "daily", creation_date=datetime(2025, 1, 1))
+        weekly = Counter("rollup_weekly", "desc", "weekly", creation_date=datetime(2024, 12, 1))
+        daily.store(self.db)
+        weekly.store(self.db)
+        daily.increment_many(self.db, ["2025-01-10"] + [f"2025-01-{day}" for day in range(25, 32)])
+        weekly.increment(self.db, "2025-01-06")
+        weekly.increment(self.db, "2025-01-20")
+        weekly.increment(self.db, "2025-01-20")
+        assert self.db.execute("SELECT completions FROM completion_rollup WHERE habit_id = ? AND day = ?",
+                               (weekly.id, datetime(2025, 1, 20).toordinal())).fetchone()[0] == 2
+
+        now = datetime(2025, 1, 31, 18, 0)
+        rates = calculate_rolling_completion_rates(self.db, now=now)
+        assert rates["rollup_daily"] == {7: 1.0, 30: 8 / 30, 365: 8 / 31}  # Not counting days before its creation
+        assert rates["rollup_weekly"][7] == 0.5  # The window touches the weeks of January 20 and 27
+        assert rates["test_habit_1"] == {7: 0.0, 30: 0.0, 365: 0.0}
+
+        counts = get_completions_between(self.db, "2025-01-20", "2025-01-31")
+        assert (counts["rollup_daily"], counts["rollup_weekly"], counts["test_habit_1"]) == (7, 2, 0)
+
+        # January 2025 starts in the week of December 30; the week of January 27 is not finished yet
+        assert calculate_slipped_habits(self.db, "weekly", now=now) == {"rollup_weekly": [datetime(2024, 12, 30), datetime(2025, 1, 13)]}
+
+    def test_streaks_as_of_date(self):
+        """
+        Test that past streaks replayed from checkpoints match what count() returned at the time.
+        """
+        days = [day for day in range(1, 61) if day % 17]  # Misses days 17, 34 and 51
+        expected = {}
+        for day in days:
+            date = datetime.fromordinal(datetime(2025, 1, 1).toordinal() + day - 1)
+            self.habit1.increment(self.db, date)
+            expected[date] = (self.habit1.count(self.db), self.habit1.longest_streak)
+        self.habit2.increment_many(self.db, ["2025-01-06", "2025-01-13", "2025-01-14"])
+
+        # Without checkpoints the queries replay from the first completion, and never write
+        for date, streaks in list(expected.items())[::10]:
+            assert streak_as_of(self.db, self.habit1.id, date) == streaks
+        assert self.db.execute("SELECT COUNT(*) FROM streak_checkpoint").fetchone()[0] == 0
+
+        assert build_checkpoints(self.db) > 0
+        self.db.execute("UPDATE tracker SET description = 'pending' WHERE id = ?", (self.habit2.id,))
+        for date, streaks in expected.items():
+            assert streak_as_of(self.db, self.habit1.id, date) == streaks
+        assert count_as_of(self.db, self.habit1.id, datetime(2024, 12, 31)) == 0
+        assert count_as_of(self.db, 12345, datetime(2025, 1, 31)) is None
+        self.db.rollback()  # The queries did not commit the caller's transaction
+        assert get_counter_by_id(self.db, self.habit2.id).description == "test_desc_2"
+
+        assert streak_leaderboard_as_of(self.db, datetime(2025, 1, 14)) == [("test_habit_1", 14, 14), ("test_habit_2", 3, 3)]
+        assert calculate_longest_streak_as_of(self.db, datetime(2025, 1, 14)).name == "test_habit_1"
+        assert calculate_longest_streak_as_of(self.db, datetime(2024, 12, 31)).name == "test_habit_1"  # Like calculate_longest_streak
+
+        # A completion on an earlier day drops the checkpoints after it; replays start from an earlier one
+        self.habit1.increment(self.db, "2025-01-17")
+        assert count_as_of(self.db, self.habit1.id, datetime(2025, 1, 20)) == 20
+        # Compaction removes the raw completions, but the rollups keep past streaks exact
+        assert compact(self.db)['deleted_completions'] > 0
+        assert streak_as_of(self.db, self.habit1.id, datetime(2025, 2, 10)) == (7, 33)
+
+    @pytest.mark.parametrize("periodicity", ["daily", "weekly", "monthly"])
+    @pytest.mark.parametrize("seed", SEEDS)
+    def test_fast_paths_match_reference(self, seed, periodicity):
+        """
+        Test that the batch, import, materialized, cached, rollup and history paths agree with incrementing
+        one completion at a time, after every chunk of a random completion sequence.
+        """
+        rng = random.Random(seed)
+        dates = random_completions(rng, periodicity, rng.randint(20, 80))
+        reference, batched, imported = (Counter(name, "desc", periodicity) for name in ("reference", "batched", "imported"))
+        for habit in (reference, batched, imported):
+            habit.store(self.db)
+
+        position = 0
+        while position < len(dates):
+            chunk = dates[position:position + rng.randint(1, 8)]
+            position += len(chunk)
+            for date in chunk:
+                reference.increment(self.db, date)
+            batched.increment_many(self.db, chunk)
+            import_completions(self.db, [(imported, chunk)])
+
+            expected = reference_streaks(periodicity, dates[:position])
+            for habit in (reference, batched, imported):
+                assert (habit.count(self.db), habit.longest_streak, habit.last_completed) == expected + (chunk[-1],)
+                stored = get_streak_counter(self.db, habit.name)
+                assert (stored.current_streak, stored.longest_streak, stored.last_completed) == expected + (chunk[-1],)
+                assert self.db.execute("SELECT next_due FROM tracker WHERE id = ?", (habit.id,)).fetchone()[0] == str(
+                    next_due(periodicity, chunk[-1]))
+                # The materialized streak is the size of the current epoch in the log
+                assert self.db.execute("SELECT COUNT(*) FROM counter WHERE habit_id = ? AND epoch = ?",
+                                       (habit.id, habit.streak_epoch)).fetchone()[0] == expected[0]
+
+        # The daily rollups count the log
+        days = {}
+        for date in dates:
+            days[date.toordinal()] = days.get(date.toordinal(), 0) + 1
+        for habit in (reference, batched, imported):
+            assert dict(self.db.execute("SELECT day, completions FROM completion_rollup WHERE habit_id = ?",
+                                        (habit.id,)).fetchall()) == days
+
+        # The vectorized statistics find the same runs
+        np = pytest.importorskip("numpy")
+        stats = calculate_completion_statistics(self.db, now=dates[-1])["batched"]
+        assert (stats['completions'], stats['longest_streak']) == (len(dates), expected[1])
+        gaps = [(later - earlier).total_seconds() / 86400 for earlier, later in zip(dates, dates[1:])]
+        assert np.isclose(stats['max_gap_days'], max(gaps, default=0))
+
+        counter_cache.enable()
+        try:
+            cached = get_streak_counter(self.db, "imported")
+            assert get_streak_counter(self.db, "imported") is cached
+            cached.increment(self.db, dates[-1])
+            expected = reference_streaks(periodicity, dates + [dates[-1]])
+            assert get_streak_counter(self.db, "imported").count(self.db) == expected[0]
+        finally:
+            counter_cache.disable()
+
+        # Past streaks stay the same after compaction removes the finished epochs from the log
+        samples = rng.sample(dates, min(len(dates), 5))
+        for compacted in (False, True):
+            if compacted:
+                compact(self.db)
+            for sample in samples:
+                before = [date for date in dates if date.toordinal() <= sample.toordinal()]
+                assert streak_as_of(self.db, reference.id, sample) == reference_streaks(periodicity, before)
+
+    def test_concurrent_load(self, tmp_path):
+        """
+        Test that interleaved writers and readers on one database file lose no completions.
+
+        HABIT_TRACKER_LOAD_OPERATIONS sets the number of completions written.
+        """
+        pool = ConnectionPool(str(tmp_path / "load.db"), max_batch=100)
+        names = [f"load_habit_{i}" for i in range(8)]
+        for future in [pool.writes.store(Counter(name, "desc", "daily")) for name in names]:
+            future.result()
+
+        rng = random.Random(0)
+        # Completions on two consecutive days continue a streak in any order, so every one adds to it
+        work = [(rng.choice(names), f"2025-01-{rng.randint(1, 2):02d}") for _ in range(LOAD_OPERATIONS)]
+        expected = {name: sum(1 for habit, date in work if habit == name) for name in names}
+        writing = threading.Event()
+        writing.set()
+        errors = []
+
+        def writer(completions):
+            try:
+                for future in [pool.writes.increment(name, date) for name, date in completions]:
+                    future.result()
+            except Exception as e:
+                errors.append(e)
+
+        def reader(seed):
+            try:
+                db = pool.connection()
+                choices = random.Random(seed)
+                seen = dict.fromkeys(names, 0)
+                while writing.is_set():
+                    name = choices.choice(names)
+                    count = get_streak_counter(db, name).count(db)
+                    assert seen[name] <= count <= expected[name]  # Readers never go back in time
+                    seen[name] = count
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=writer, args=(work[i::8],)) for i in range(8)]
+        readers = [threading.Thread(target=reader, args=(seed,)) for seed in range(4)]
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        assert errors == []
+        db = pool.connection()
+        assert {name: get_streak_counter(db, name).count(db) for name in names} == expected
+        assert dict(db.execute("""SELECT name, COUNT(*) FROM counter JOIN tracker ON tracker.id = counter.habit_id
+                                  GROUP BY name""").fetchall()) == expected
+        assert dict(db.execute("""SELECT name, SUM(completions) FROM completion_rollup
+                                  JOIN tracker ON tracker.id = completion_rollup.habit_id GROUP BY name""").fetchall()) == expected
+        pool.close()
+
+    def test_due_scheduler(self):
+        """
+        Test that streak deadlines are kept up to date and found through the next_due index.
+        """
+        self.habit1.increment(self.db, "2025-01-10")
+        self.habit2.increment(self.db, "2025-01-08")  # The week of Monday, January 6
+        assert [(habit.name, deadline) for habit, deadline in due_before(self.db, datetime(2025, 1, 31))] == [
+            ("test_habit_1", datetime(2025, 1, 12)), ("test_habit_2", datetime(2025, 1, 20))]
+        assert [habit.name for habit, deadline in due_before(self.db, datetime(2025, 1, 15))] == ["test_habit_1"]
+        assert [habit.name for habit, deadline in due_before(self.db, datetime(2025, 1, 31), since=datetime(2025, 1, 13))] == ["test_habit_2"]
+
+        self.habit1.reset(self.db)
+        self.habit2.increment_many(self.db, ["2025-01-21"])  # Too late, a new streak with a new deadline
+        assert [(habit.name, habit.current_streak, deadline) for habit, deadline in due_before(self.db, datetime(2025, 3, 1))] == [
+            ("test_habit_2", 1, datetime(2025, 2, 3))]
+        self.habit2.remove(self.db)
+        assert due_before(self.db, datetime(2025, 3, 1)) == []
+
+        plan = self.db.execute("EXPLAIN QUERY PLAN SELECT id FROM tracker WHERE next_due < ? ORDER BY next_due",
+                               (datetime(2025, 3, 1),)).fetchall()
+        assert "idx_tracker_next_due" in plan[0][3]
+
+    def test_event_logging(self):
+        """
+        Test that tracker messages go through the queued logger, with sampling and silencing.
+        """
+        captured = logging.handlers.BufferingHandler(1000)
+        try:
+            events.configure(handlers=[captured])
+            self.habit1.increment(self.db, "2025-01-30")
+            Counter("test_habit_1", "duplicate", "daily").store(self.db)
+            events.flush()
+            assert [record.getMessage() for record in captured.buffer] == [
+                f"Habit test_habit_1 (ID: {self.habit1.id}) completed successfully on 2025-01-30 00:00:00!",
+                "Counter 'test_habit_1' already exists."]
+
+            captured.flush()
+            events.configure(sample_rate=0, handlers=[captured])  # Drops every message below WARNING
+            self.habit1.increment(self.db, "2025-01-31")
+            Counter("test_habit_2", "duplicate", "weekly").store(self.db)
+            events.flush()
+            assert [record.levelno for record in captured.buffer] == [logging.WARNING]
+
+            captured.flush()
+            events.silence()
+            Counter("test_habit_2", "duplicate", "weekly").store(self.db)
+            events.flush()
+            assert captured.buffer == []
+        finally:
+            events.shutdown()
+
+    def test_id_based_lookups(self, monkeypatch):
+        """
+        Test the id-first lookups and the name <-> id index kept in sync by store and remove.
+        """
+        monkeypatch.setattr("db.IN_CHUNK_SIZE", 1)  # One IN query per id or name
+        ids = [self.habit1.id, self.habit2.id, 12345]
+        assert {habit_id: habit.name for habit_id, habit in get_counters(self.db, ids).items()} == {
+            self.habit1.id: "test_habit_1", self.habit2.id: "test_habit_2"}
+        assert get_counter_by_id(self.db, self.habit2.id).periodicity == "weekly"
+        assert get_counter_by_id(self.db, 12345) is None
+        assert get_habit_ids(self.db, ["test_habit_2", "missing"]) == {"test_habit_2": self.habit2.id}
+
+        habit_index.enable()
+        try:
+            assert get_habit_ids(self.db, ["test_habit_1"]) == {"test_habit_1": self.habit1.id}  # Loads the index
+            added = Counter("test_habit_3", "desc", "daily")
+            added.store(self.db)
+            instrumentation.reset()
+            instrumentation.enable()
+            try:
+                assert get_habit_ids(self.db, ["test_habit_1", "test_habit_3"]) == {
+                    "test_habit_1": self.habit1.id, "test_habit_3": added.id}
+            finally:
+                instrumentation.disable()
+            assert instrumentation.snapshot()['get_habit_ids']['queries'] == 0  # The stored habit was added to the index
+            instrumentation.reset()
+
+            self.habit1.remove(self.db)
+            assert habit_index.name_of(self.db, added.id) == "test_habit_3"
+            assert get_streak_counter(self.db, "test_habit_1") is None
+            assert get_streak_counter(self.db, "test_habit_3").id == added.id
+
+            # With the cache on as well, a cold and a warm lookup are one miss and one hit
+            counter_cache.enable()
+            get_streak_counter(self.db, "test_habit_2")
+            get_streak_counter(self.db, "test_habit_2")
+            stats = counter_cache.stats()
+            assert (stats['hits'], stats['misses']) == (1, 1)
+            counter_cache.clear()
+
+            # Closing a connection drops its index map and cached habits, so it is not kept alive
+            other = get_db(':memory:')
+            Counter("other_habit", "desc", "daily").store(other)
+            assert get_streak_counter(other, "other_habit") is get_streak_counter(other, "other_habit")
+            assert other in habit_index._ids
+            other.close()
+            assert other not in habit_index._ids and other not in habit_index._names
+            assert counter_cache.stats()['size'] == 0
+        finally:
+            counter_cache.disable()
+            habit_index.disable()
+
+    def test_migrates_existing_database(self, tmp_path):
+        """
+        Test that a database created by the original schema is upgraded in place.
+        """
+        path = str(tmp_path / "old.db")
+        old = sqlite3.connect(path)
+        old.execute("CREATE TABLE tracker (id INTEGER PRIMARY KEY, name TEXT UNIQUE, description TEXT, periodicity TEXT, creation_date TEXT)")
+        old.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, habit_id INTEGER, increment_date TEXT)")
+        old.execute("INSERT INTO tracker (id, name, description, periodicity) VALUES (1, 'old_habit', 'desc', 'daily')")
+        old.execute("INSERT INTO counter (habit_id, increment_date) VALUES (1, '2025-01-30 00:00:00'), (2, '2025-01-30 00:00:00')")
+        old.commit()
+        old.close()
+
+        db = get_db(path)
+        assert get_schema_version(db) == SCHEMA_VERSION
+        habit = get_streak_counter(db, "old_habit")
+        assert habit.count(db) == 1  # The orphaned completion of habit 2 is dropped
+
+        plan = db.execute("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM counter WHERE habit_id = 1").fetchall()
+        assert "USING COVERING INDEX idx_counter_habit" in plan[0][3]
+        assert db.execute("SELECT period_index FROM counter").fetchall() == [(datetime(2025, 1, 30).toordinal(),)]
+        assert db.execute("SELECT name FROM sqlite_master WHERE name = 'idx_counter_habit_period'").fetchone() is None
+        assert db.execute("SELECT day, habit_id, completions FROM completion_rollup").fetchall() == [(datetime(2025, 1, 30).toordinal(), 1, 1)]
+
+        habit.remove(db)
+        assert db.execute("SELECT COUNT(*) FROM counter").fetchone()[0] == 0  # Removed by the cascade
+        db.close()
+
+        # Streak deadlines are filled in for habits with a streak
+        db = sqlite3.connect(str(tmp_path / "v8.db"))
+        migrate(db, target=8)
+        db.execute('''INSERT INTO tracker (name, description, periodicity, last_completed, current_streak)
+                      VALUES ('weekly_habit', 'desc', 'weekly', '2025-01-08 09:00:00', 2), ('idle_habit', 'desc', 'daily', NULL, 0)''')
+        db.commit()
+        migrate(db)
+        assert db.execute("SELECT name, next_due FROM tracker ORDER BY name").fetchall() == [
+            ("idle_habit", None), ("weekly_habit", "2025-01-20 00:00:00")]
+        db.close()
+
+        # A date no migration can parse rolls that migration back and fails the connection, not the caller
+        path = str(tmp_path / "bad.db")
+        old = sqlite3.connect(path)
+        old.execute("CREATE TABLE tracker (id INTEGER PRIMARY KEY, name TEXT UNIQUE, description TEXT, periodicity TEXT, creation_date TEXT)")
+        old.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, habit_id INTEGER, increment_date TEXT)")
+        old.execute("INSERT INTO tracker (id, name, description, periodicity) VALUES (1, 'old_habit', 'desc', 'daily')")
+        old.execute("INSERT INTO counter (habit_id, increment_date) VALUES (1, '30/01/2025')")
+        old.commit()
+        old.close()
+        assert get_db(path) is None
+        old = sqlite3.connect(path)  # Not locked by an open transaction or connection
+        assert get_schema_version(old) == 4  # Migration 5 stores period indexes
+        assert "period_index" not in [column[1] for column in old.execute("PRAGMA table_info(counter)")]
+        old.close()
+
     def teardown_method(self):
         """Clean up after each test method by closing the database connection."""
         if self.db: